@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
 
 # Register your models here.
+from . import profiling
 from .models import Category, Article, Page, Tag
 from .forms import ArticleForm
 
@@ -13,3 +15,15 @@ admin.site.register(Category)
 admin.site.register(Tag)
 admin.site.register(Article, ArticleAdmin)
 admin.site.register(Page)
+
+
+def profiling_view(request):
+    """Timings of the sampled requests of this process, per URL name."""
+    context = dict(
+        admin.site.each_context(request),
+        title='Profiling',
+        routes=profiling.summaries(),
+        buckets=['<= %d ms' % bound for bound in profiling.BUCKETS] + [
+            '> %d ms' % profiling.BUCKETS[-1]],
+    )
+    return TemplateResponse(request, 'admin/blog/profiling.html', context)
@@ -0,0 +1,265 @@
+# coding: utf-8
+"""Read-only JSON API of the published content.
+
+Articles are listed newest first with the keyset pagination of
+``blog.paginator``, ``next`` and ``previous`` link to the neighbouring
+pages with ``?after=`` and ``?before=`` cursors. ``?fields=title,url``
+selects the fields of every item. Only the columns these fields need are
+read, as values without instantiating models, so ``content_html`` is never
+loaded unless it was asked for.
+
+The URLs go through the page cache and the ETag/Last-Modified validators
+of the HTML views, see ``blog.urls``.
+"""
+from collections import OrderedDict
+from datetime import MAXYEAR, MINYEAR
+from functools import lru_cache, wraps
+from operator import itemgetter
+
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.views.decorators.gzip import gzip_page
+
+from .constants import API_ITEMS_PER_PAGE, API_MAX_ITEMS
+from .models import Category, Article, Page, Tag
+from .paginator import CursorPaginator, InvalidCursor, make_cursor
+from . import sitemaps
+
+
+class BadRequest(Exception):
+    pass
+
+
+# The URLs of the items, reversed once.
+url_format = lru_cache(maxsize=None)(sitemaps.url_format)
+
+
+def value(column):
+    return [column], itemgetter(column)
+
+
+def article_url(row):
+    published_time = row['published_time'].astimezone(timezone.utc)
+    return url_format('blog:detail', 'year', 'month', 'slug').format(
+        year=published_time.year, month=published_time.month,
+        slug=row['slug'])
+
+
+def slug_url(name):
+    def url(row):
+        return url_format(name, 'slug').format(slug=row['slug'])
+    return url
+
+
+# Field name: (columns read, value of a row)
+ARTICLE_FIELDS = OrderedDict([
+    ('id', value('id')),
+    ('title', value('title')),
+    ('slug', value('slug')),
+    ('url', (['published_time', 'slug'], article_url)),
+    ('category', (['category__name', 'category__slug'], lambda row: {
+        'name': row['category__name'], 'slug': row['category__slug']})),
+    # Set by add_tags.
+    ('tags', (['id'], itemgetter('tags'))),
+    ('excerpt_html', value('excerpt_html')),
+    ('content_html', value('content_html')),
+    ('published_time', value('published_time')),
+    ('updated_time', value('updated_time')),
+])
+ARTICLE_LIST_FIELDS = [name for name in ARTICLE_FIELDS
+                       if name != 'content_html']
+
+TAXONOMY_FIELDS = OrderedDict([
+    ('id', value('id')),
+    ('name', value('name')),
+    ('slug', value('slug')),
+    ('published_count', value('published_count')),
+])
+CATEGORY_FIELDS = OrderedDict(list(TAXONOMY_FIELDS.items()) + [
+    ('url', (['slug'], slug_url('blog:category'))),
+    ('articles', (['slug'], slug_url('blog:api_category'))),
+])
+TAG_FIELDS = OrderedDict(list(TAXONOMY_FIELDS.items()) + [
+    ('url', (['slug'], slug_url('blog:tag'))),
+    ('articles', (['slug'], slug_url('blog:api_tag'))),
+])
+
+PAGE_FIELDS = OrderedDict([
+    ('id', value('id')),
+    ('title', value('title')),
+    ('slug', value('slug')),
+    ('url', (['slug'], slug_url('blog:page'))),
+    ('rank', value('rank')),
+    ('content_html', value('content_html')),
+    ('updated_time', value('updated_time')),
+])
+PAGE_LIST_FIELDS = [name for name in PAGE_FIELDS if name != 'content_html']
+
+
+def requested_fields(request, fields, default):
+    """The names of ``fields`` asked for with ``?fields=``."""
+    names = request.GET.get('fields')
+    if not names:
+        return default
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown or not names:
+        raise BadRequest('Unknown fields: %s. Choose from %s.' % (
+            ', '.join(unknown), ', '.join(fields)))
+    return names
+
+
+def select(queryset, fields, names, *columns):
+    """The values of ``queryset`` needed for the fields ``names``, and
+    ``columns``."""
+    columns = set(columns)
+    for name in names:
+        columns.update(fields[name][0])
+    return queryset.values(*sorted(columns))
+
+
+def serialize(row, fields, names):
+    return OrderedDict((name, fields[name][1](row)) for name in names)
+
+
+def add_tags(rows):
+    """Set the ``tags`` of article ``rows`` in one query."""
+    tags = dict((row['id'], []) for row in rows)
+    for article_id, name, slug in Article.tags.through.objects.filter(
+            article_id__in=list(tags)).order_by('tag__name').values_list(
+                'article_id', 'tag__name', 'tag__slug'):
+        tags[article_id].append({'name': name, 'slug': slug})
+    for row in rows:
+        row['tags'] = tags[row['id']]
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('limit', API_ITEMS_PER_PAGE))
+    except ValueError:
+        raise BadRequest('limit must be a number.')
+    return min(max(size, 1), API_MAX_ITEMS)
+
+
+def page_link(request, direction, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    query[direction] = cursor
+    return request.build_absolute_uri('%s?%s' % (request.path,
+                                                 query.urlencode()))
+
+
+def json_view(view):
+    """Answer errors in JSON too and gzip the responses.
+
+    Django 1.10 appends ``;gzip`` to the ETag of a compressed response,
+    which is removed from ``If-None-Match`` again so that clients
+    accepting gzip get their 304s.
+    """
+    @wraps(view)
+    def errors(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Http404:
+            return JsonResponse({'error': 'Not found.'}, status=404)
+
+    compressed = gzip_page(errors)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        etags = request.META.get('HTTP_IF_NONE_MATCH')
+        if etags:
+            request.META['HTTP_IF_NONE_MATCH'] = etags.replace(';gzip"', '"')
+        return compressed(request, *args, **kwargs)
+    return wrapper
+
+
+def article_list(request, queryset):
+    names = requested_fields(request, ARTICLE_FIELDS, ARTICLE_LIST_FIELDS)
+    rows = select(queryset, ARTICLE_FIELDS, names, 'id', 'published_time')
+    paginator = CursorPaginator(rows, page_size(request), cursor=lambda row:
+                                make_cursor(row['published_time'], row['id']))
+    try:
+        page = paginator.page(after=request.GET.get('after'),
+                              before=request.GET.get('before'))
+    except InvalidCursor:
+        raise BadRequest('Invalid cursor.')
+    rows = page.object_list
+    if 'tags' in names:
+        add_tags(rows)
+    return JsonResponse(OrderedDict([
+        ('results', [serialize(row, ARTICLE_FIELDS, names) for row in rows]),
+        ('next', page_link(request, 'after', page.next_cursor)),
+        ('previous', page_link(request, 'before', page.previous_cursor)),
+    ]))
+
+
+def slug_pk(queryset, slug):
+    pk = queryset.filter(slug=slug).values_list('pk', flat=True).first()
+    if pk is None:
+        raise Http404
+    return pk
+
+
+def articles(request):
+    return article_list(request, Article.published.all())
+
+
+def category_articles(request, slug):
+    return article_list(request, Article.published.filter(
+        category_id=slug_pk(Category.objects, slug)))
+
+
+def tag_articles(request, slug):
+    return article_list(request, Article.published.filter(
+        tags=slug_pk(Tag.objects, slug)))
+
+
+def article(request, year, month, slug):
+    names = requested_fields(request, ARTICLE_FIELDS, list(ARTICLE_FIELDS))
+    year, month = int(year), int(month)
+    if not (1 <= month <= 12 and MINYEAR <= year < MAXYEAR):
+        raise Http404
+    queryset = Article.published.in_month(year, month).filter(slug=slug)
+    rows = list(select(queryset, ARTICLE_FIELDS, names, 'id')[:1])
+    if not rows:
+        raise Http404
+    if 'tags' in names:
+        add_tags(rows)
+    return JsonResponse(serialize(rows[0], ARTICLE_FIELDS, names))
+
+
+def object_list(request, queryset, fields, default):
+    names = requested_fields(request, fields, default)
+    return JsonResponse({'results': [
+        serialize(row, fields, names)
+        for row in select(queryset, fields, names)]})
+
+
+def categories(request):
+    return object_list(request, Category.objects.filter(
+        published_count__gt=0), CATEGORY_FIELDS, list(CATEGORY_FIELDS))
+
+
+def tags(request):
+    return object_list(request, Tag.objects.filter(published_count__gt=0),
+                       TAG_FIELDS, list(TAG_FIELDS))
+
+
+def pages(request):
+    return object_list(request, Page.objects.filter(status=0), PAGE_FIELDS,
+                       PAGE_LIST_FIELDS)
+
+
+def page(request, slug):
+    names = requested_fields(request, PAGE_FIELDS, list(PAGE_FIELDS))
+    rows = list(select(Page.objects.filter(slug=slug, status=0), PAGE_FIELDS,
+                       names)[:1])
+    if not rows:
+        raise Http404
+    return JsonResponse(serialize(rows[0], PAGE_FIELDS, names))
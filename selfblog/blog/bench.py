@@ -0,0 +1,263 @@
+# coding: utf-8
+"""Latency, query and memory benchmark of the public URLs.
+
+``generate_corpus`` fills the database with a synthetic blog, ``run``
+requests every route of ``blog.urls`` through the test client and
+``compare`` reports the views which got slower, run more queries or use
+more memory than a stored baseline. ``manage.py blog_bench`` ties them
+together on a throwaway test database.
+"""
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import related, search, sitemaps
+from .models import (Category, Article, ArticleViewCount, Page, Tag,
+                     ArchiveMonth)
+from .rendering import render_rows
+from .urls import urlpatterns
+
+
+WORDS = ('django python cache query index template view model database '
+         'replica latency request response markdown feed archive tag '
+         'category page search benchmark memory profile').split()
+
+# Compared against the baseline, latency and memory may grow by the
+# tolerance given to ``compare``, query counts not at all.
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_kb')
+
+
+def code_block(rng):
+    number = rng.randrange(50)
+    return rng.choice([
+        '```python\ndef view_%d(request):\n'
+        '    return render(request, "blog/index.html", '
+        '{"items": range(%d)})\n```' % (number, number),
+        '```sql\nSELECT id, title FROM blog_article\n'
+        'WHERE status = 0 ORDER BY published_time DESC LIMIT %d;\n```'
+        % number,
+    ])
+
+
+def paragraph(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+
+
+def generate_corpus(articles=1000, categories=10, tags=100, seed=0,
+                    batch_size=400):
+    """Create a synthetic blog: articles with code blocks, several
+    categories, many tags per article and a couple of pages."""
+    rng = random.Random(seed)
+    Category.objects.bulk_create(
+        [Category(name='Category %d' % i, slug='category%d' % i)
+         for i in range(categories)])
+    Tag.objects.bulk_create(
+        [Tag(name='Tag %d' % i, slug='tag-%d' % i) for i in range(tags)])
+    category_ids = list(Category.objects.values_list('pk', flat=True))
+    tag_ids = list(Tag.objects.values_list('pk', flat=True))
+
+    sources = []
+    for i in range(articles):
+        parts = ['# Article %d' % i]
+        for _ in range(rng.randint(2, 6)):
+            parts.append(paragraph(rng))
+            if rng.random() < 0.5:
+                parts.append(code_block(rng))
+        sources.append((i, '\n\n'.join(parts)))
+
+    now = timezone.now()
+    rows = []
+    for i, digest, html, excerpt in render_rows(sources):
+        rows.append(Article(
+            category_id=category_ids[i % len(category_ids)],
+            title='Article %d %s' % (i, rng.choice(WORDS)),
+            slug='article-%d' % i, content=sources[i][1],
+            content_html=html, content_hash=digest, excerpt_html=excerpt,
+            # Drafts and hidden articles are part of every real blog.
+            status=0 if rng.random() < 0.9 else rng.choice([1, 2]),
+            published_time=now - timedelta(hours=i * 7)))
+    Article.objects.bulk_create(rows, batch_size=batch_size)
+
+    through = Article.tags.through
+    links = []
+    for pk in Article.objects.values_list('pk', flat=True):
+        for tag_id in rng.sample(tag_ids, min(len(tag_ids),
+                                              rng.randint(1, 8))):
+            links.append(through(article_id=pk, tag_id=tag_id))
+    through.objects.bulk_create(links, batch_size=batch_size)
+    ArticleViewCount.objects.bulk_create(
+        [ArticleViewCount(article_id=pk, views=int(rng.paretovariate(1)))
+         for pk in Article.objects.values_list('pk', flat=True)],
+        batch_size=batch_size)
+
+    for i, title in enumerate(('About', 'Links', 'Projects')):
+        Page.objects.create(title=title, slug=title.lower(), rank=i,
+                            content=paragraph(rng), status=0)
+    search.index_articles(Article.objects.all())
+    Category.objects.recount()
+    Tag.objects.recount()
+    ArchiveMonth.objects.rebuild()
+    related.rebuild()
+
+
+def sample_urls(count, seed=0):
+    """Return ``{route name: [url, ...]}`` for every route of
+    ``blog.urls``, with up to ``count`` distinct URLs per route."""
+    rng = random.Random(seed)
+
+    def pick(values):
+        values = list(values)
+        rng.shuffle(values)
+        return values[:count]
+
+    published = Article.published.values_list('published_time', 'slug')
+    builders = {
+        'index': lambda: ['/'] + ['/?page=%d' % n for n in range(2, count)],
+        'detail': lambda: [
+            reverse('blog:detail', args=[t.year, t.month, slug])
+            for t, slug in published.order_by('?')[:count]],
+        'page': lambda: [reverse('blog:page', args=[slug]) for slug in pick(
+            Page.objects.filter(status=0).values_list('slug', flat=True))],
+        'popular': lambda: [reverse('blog:popular')],
+        'archives': lambda: [reverse('blog:archives')],
+        'archive_year': lambda: [
+            reverse('blog:archive_year', args=[year]) for year in pick(
+                ArchiveMonth.objects.order_by('year').values_list(
+                    'year', flat=True).distinct())],
+        'archive_month': lambda: [
+            reverse('blog:archive_month', args=[year, month])
+            for year, month in pick(
+                ArchiveMonth.objects.values_list('year', 'month'))],
+        'categories': lambda: [reverse('blog:categories')],
+        'category': lambda: [
+            reverse('blog:category', args=[slug]) for slug in pick(
+                Category.objects.values_list('slug', flat=True))],
+        'tags': lambda: [reverse('blog:tags')],
+        'tag': lambda: [reverse('blog:tag', args=[slug]) for slug in pick(
+            Tag.objects.values_list('slug', flat=True))],
+        'search': lambda: ['%s?q=%s' % (reverse('blog:search'), word)
+                           for word in pick(WORDS)],
+        'feed': lambda: [reverse('blog:feed')],
+        'category_feed': lambda: [
+            reverse('blog:category_feed', args=[slug]) for slug in pick(
+                Category.objects.values_list('slug', flat=True))],
+        'tag_feed': lambda: [
+            reverse('blog:tag_feed', args=[slug]) for slug in pick(
+                Tag.objects.values_list('slug', flat=True))],
+        'api_articles': lambda: [reverse('blog:api_articles')],
+        'api_article': lambda: [
+            reverse('blog:api_article', args=[t.year, t.month, slug])
+            for t, slug in published.order_by('?')[:count]],
+        'api_categories': lambda: [reverse('blog:api_categories')],
+        'api_category': lambda: [
+            reverse('blog:api_category', args=[slug]) for slug in pick(
+                Category.objects.values_list('slug', flat=True))],
+        'api_tags': lambda: [reverse('blog:api_tags')],
+        'api_tag': lambda: [
+            reverse('blog:api_tag', args=[slug]) for slug in pick(
+                Tag.objects.values_list('slug', flat=True))],
+        'api_pages': lambda: [reverse('blog:api_pages')],
+        'api_page': lambda: [
+            reverse('blog:api_page', args=[slug]) for slug in pick(
+                Page.objects.filter(status=0).values_list('slug', flat=True))],
+        'sitemap': lambda: [reverse('blog:sitemap')],
+        'sitemap_section': lambda: [
+            reverse('blog:sitemap_section', args=[name, 0])
+            for name in sitemaps.SECTIONS],
+    }
+    urls = {}
+    for pattern in urlpatterns:
+        if pattern.name not in builders:
+            raise ValueError('No benchmark URLs for the %r route of '
+                             'blog.urls.' % (pattern.name or pattern.regex))
+        urls[pattern.name] = builders[pattern.name]() or []
+    return urls
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted ``values``."""
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def measure(client, urls, requests):
+    """Request ``urls`` in turn ``requests`` times after one warm-up round.
+
+    Return the statistics of the route, latencies in milliseconds and the
+    peak memory of one request in kilobytes.
+    """
+    for url in urls:
+        response = client.get(url)
+        response.getvalue()
+        if response.status_code != 200:
+            raise ValueError('%s returned %d' % (url, response.status_code))
+
+    timings = []
+    queries = 0
+    for i in range(requests):
+        url = urls[i % len(urls)]
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            # Read streamed responses to the end.
+            client.get(url).getvalue()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries += len(captured)
+
+    # Tracing allocations slows everything down, measure it separately.
+    tracemalloc.start()
+    try:
+        client.get(urls[0]).getvalue()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'rps': round(requests / (sum(timings) / 1000), 1),
+        'queries': round(queries / float(requests), 2),
+        'peak_kb': round(peak / 1024.0, 1),
+    }
+
+
+def run(requests=50, urls_per_route=10, page_cache=False, seed=0):
+    """Benchmark every route, return ``{route name: statistics}``."""
+    urls = sample_urls(urls_per_route, seed)
+    client = Client()
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False,
+                           BLOG_PAGE_CACHE=page_cache,
+                           BLOG_PROFILING_SAMPLE_RATE=0,
+                           BLOG_READ_REPLICAS=[], BLOG_COUNT_VIEWS=False):
+        for name in sorted(urls):
+            if urls[name]:
+                results[name] = measure(client, urls[name], requests)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return a message for every regression of ``results`` over
+    ``baseline``."""
+    regressions = []
+    for name, stats in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if stats['queries'] > base['queries']:
+            regressions.append('%s: %s queries, was %s' % (
+                name, stats['queries'], base['queries']))
+        for metric in METRICS:
+            if stats[metric] > base[metric] * (1 + tolerance):
+                regressions.append('%s: %s %s, was %s' % (
+                    name, metric, stats[metric], base[metric]))
+    return regressions
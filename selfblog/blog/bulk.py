@@ -0,0 +1,20 @@
+# coding: utf-8
+"""Bulk writes which Django 1.10 does not provide."""
+from django.db.models import Case, Value, When
+
+
+def bulk_update(model, rows, fields):
+    """Update many rows with different values in a single statement.
+
+    ``rows`` maps primary keys to a dict of field values, every dict must
+    have all of ``fields``. Return the number of updated rows.
+    """
+    if not rows:
+        return 0
+    updates = {}
+    for name in fields:
+        updates[name] = Case(
+            *[When(pk=pk, then=Value(values[name]))
+              for pk, values in rows.items()],
+            output_field=model._meta.get_field(name))
+    return model._default_manager.filter(pk__in=list(rows)).update(**updates)
@@ -0,0 +1,294 @@
+# coding: utf-8
+"""Full page cache for the public views.
+
+A cached page is stored under its URL with the current version of every
+scope it depends on, e.g. ``articles`` for all listings or ``tag:python``
+for the python tag listing. Writes don't delete pages, they bump the
+version of the affected scopes (see ``blog.signals``), which outdates the
+pages rendered with the old one.
+
+An outdated or expired page is rendered again by a single request holding
+a lock, while the others keep serving the stale copy. A write to a popular
+article then doesn't send every concurrent request to the database at once.
+"""
+import hashlib
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import MAXYEAR, MINYEAR
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import parse_http_date_safe, unquote_etag
+
+from .constants import (PAGE_CACHE_TIMEOUT, CACHE_TTL_JITTER,
+                        CACHE_STALE_TIMEOUT, CACHE_LOCK_TIMEOUT,
+                        CACHE_EARLY_REFRESH_WINDOW, CACHE_EARLY_REFRESH,
+                        HOT_ARTICLES, HOT_ARTICLE_TIMEOUT)
+from .models import Article
+
+
+# Bumped to drop every cached page at once.
+SITE = 'site'
+# Every page listing articles: index, archives, categories, tags and feed.
+ARTICLES = 'articles'
+# The published pages linked from the sidebar of every page.
+PAGES = 'pages'
+# The popular posts page, bumped whenever view counts are written.
+POPULAR = 'popular'
+
+
+def article_scope(slug):
+    return 'article:%s' % slug
+
+
+def page_scope(slug):
+    return 'page:%s' % slug
+
+
+def category_scope(slug):
+    return 'category:%s' % slug
+
+
+def tag_scope(slug):
+    return 'tag:%s' % slug
+
+
+def _version_key(scope):
+    return 'blog:version:%s' % scope
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def get_versions(scopes):
+    """Return the current version of each scope, in order."""
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Never seen or evicted, start a version no page was cached with.
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+# Set for the replication lag after every invalidation, see
+# ``recently_invalidated``.
+_INVALIDATED_KEY = 'blog:invalidated'
+
+
+def invalidate(*scopes):
+    cache.set_many(
+        dict((_version_key(scope), _new_version()) for scope in set(scopes)),
+        None)
+    cache.set(_INVALIDATED_KEY, True,
+              getattr(settings, 'BLOG_REPLICA_STICKY_SECONDS', 10))
+
+
+def recently_invalidated():
+    """Whether a scope was invalidated less than
+    ``BLOG_REPLICA_STICKY_SECONDS`` ago.
+
+    The replicas may not have the write yet, and a page rendered from them
+    would be cached under the new versions.
+    """
+    return cache.get(_INVALIDATED_KEY) is not None
+
+
+def invalidate_all():
+    invalidate(SITE)
+
+
+def _lock_key(key):
+    return '%s:lock' % key
+
+
+def lookup(key, versions):
+    """Return the value cached under ``key`` for ``versions``, or None when
+    the caller has to compute it and pass it to ``store``.
+
+    A value cached for other versions, or expired, is returned to everyone
+    but the one caller which gets the lock to compute it again. Close to
+    its expiry, a fresh value is computed again early by chance. Nobody
+    waits for a value which isn't cached at all, every caller computes it.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    value, entry_versions, fresh_until, timeout = entry
+    now = time.time()
+    if entry_versions == versions and now < fresh_until:
+        if (fresh_until - now > timeout * CACHE_EARLY_REFRESH_WINDOW or
+                random.random() >= CACHE_EARLY_REFRESH):
+            return value
+    if cache.add(_lock_key(key), True, CACHE_LOCK_TIMEOUT):
+        return None
+    return value
+
+
+def store(key, versions, value, timeout=PAGE_CACHE_TIMEOUT):
+    """Cache ``value`` computed for ``versions`` and release the lock."""
+    timeout = timeout * (1 - random.random() * CACHE_TTL_JITTER)
+    cache.set(key, (value, versions, time.time() + timeout, timeout),
+              int(timeout) + CACHE_STALE_TIMEOUT)
+    release(key)
+
+
+def release(key):
+    """Release the lock of ``key`` when its value can't be cached."""
+    cache.delete(_lock_key(key))
+
+
+def discard(key):
+    """Drop the value of ``key`` and release its lock, when the value
+    computed for the current versions can't be cached and the old one must
+    not be served any more."""
+    cache.delete_many([key, _lock_key(key)])
+
+
+def cached(key, scopes, compute, timeout=PAGE_CACHE_TIMEOUT):
+    """Return the value of ``compute()`` cached under ``key`` until one of
+    ``scopes`` is invalidated or ``timeout`` expires."""
+    versions = get_versions(scopes)
+    value = lookup(key, versions)
+    if value is None:
+        try:
+            value = compute()
+        except Exception:
+            release(key)
+            raise
+        store(key, versions, value, timeout)
+    return value
+
+
+def page_cache_enabled():
+    return getattr(settings, 'BLOG_PAGE_CACHE', False)
+
+
+def page_key(request):
+    url = '%s%s' % (request.get_host(), request.get_full_path())
+    return 'blog:page:%s' % hashlib.md5(force_bytes(url)).hexdigest()
+
+
+def not_modified(request, response):
+    """Answer a conditional request from the validators of a cached page."""
+    etag = response.get('ETag')
+    last_modified = response.get('Last-Modified')
+    return get_conditional_response(
+        request,
+        etag=unquote_etag(etag) if etag else None,
+        last_modified=parse_http_date_safe(last_modified)
+        if last_modified else None,
+        response=response)
+
+
+def cache_public_page(*scopes):
+    """Cache a public view until one of its scopes is invalidated.
+
+    Scopes may refer to URL keyword arguments, e.g. ``'tag:{slug}'``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not page_cache_enabled() or request.method != 'GET':
+                return view(request, *args, **kwargs)
+
+            page_scopes = [SITE] + [scope.format(**kwargs) for scope in scopes]
+            versions = get_versions(page_scopes)
+            key = page_key(request)
+            response = lookup(key, versions)
+            if response is not None:
+                return not_modified(request, response) or response
+
+            try:
+                response = view(request, *args, **kwargs)
+            except Http404:
+                # Unpublished or deleted, the others must not keep serving
+                # the old page until it expires.
+                discard(key)
+                raise
+            except Exception:
+                release(key)
+                raise
+            if response.status_code == 200 and not response.cookies:
+                if response.streaming:
+                    # Caching it would hold the whole page in memory,
+                    # streamed views cache their fragments themselves.
+                    release(key)
+                elif hasattr(response, 'render') and callable(response.render):
+                    response.add_post_render_callback(
+                        lambda r: store(key, versions, r))
+                else:
+                    store(key, versions, response)
+            elif response.status_code == 304:
+                release(key)
+            else:
+                discard(key)
+            return response
+        return wrapper
+    return decorator
+
+
+class VersionedLRU(object):
+    """In-process LRU whose entries are only served while the versions of
+    their scopes are unchanged and for at most ``timeout`` seconds."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, entry_versions, expires = entry
+            if entry_versions != versions or expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, versions, value):
+        with self._lock:
+            self._entries[key] = (value, versions,
+                                  time.time() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+hot_articles = VersionedLRU(HOT_ARTICLES, HOT_ARTICLE_TIMEOUT)
+
+
+def published_article(year, month, slug):
+    """Return the published article at ``/post/<year>/<month>/<slug>`` or
+    None.
+
+    Found articles are kept in ``hot_articles`` and shared by the requests
+    of this process, they must not be modified.
+    """
+    if not (1 <= month <= 12 and MINYEAR <= year < MAXYEAR):
+        return None
+    key = (year, month, slug)
+    versions = get_versions([SITE, article_scope(slug)])
+    article = hot_articles.get(key, versions)
+    if article is None:
+        article = Article.published.for_detail(year, month, slug).first()
+        if article is not None:
+            hot_articles.set(key, versions, article)
+    return article
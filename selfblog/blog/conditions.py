@@ -0,0 +1,112 @@
+# coding: utf-8
+"""ETag and Last-Modified validators for the public views.
+
+Each validator costs at most one query once the navigation is cached, run
+before the page cache or the view itself, so a client holding a fresh copy gets its 304 without any
+template rendering or content loading.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, DateTimeField, Max
+from django.db.models.expressions import RawSQL
+from django.utils.encoding import force_bytes, force_text
+from django.views.decorators.http import condition
+
+from . import cache
+from .models import Category, Article, Page, Tag
+
+
+def memoize_on_request(func):
+    """Run ``func`` once per request, the ETag and Last-Modified callbacks
+    of ``condition`` share the same query."""
+    attr = '_blog_%s' % func.__name__
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        if not hasattr(request, attr):
+            setattr(request, attr, func(request, *args, **kwargs))
+        return getattr(request, attr)
+    return wrapper
+
+
+def make_etag(*parts):
+    # The site version changes when everything is invalidated at once,
+    # e.g. after re-rendering all articles.
+    parts = cache.get_versions([cache.SITE]) + [force_text(p) for p in parts]
+    return hashlib.md5(force_bytes('|'.join(parts))).hexdigest()
+
+
+def navigation_state(last_modified):
+    """Add the pages of the sidebar to the state of a page last modified
+    at ``last_modified``.
+
+    Their latest ``updated_time`` is cached until a page is written, and
+    the version of the pages tells deletes apart.
+    """
+    if last_modified is None:
+        return {'last_modified': None}
+    pages_updated, = cache.cached(
+        'blog:pages-updated', [cache.SITE, cache.PAGES],
+        lambda: (Page.objects.aggregate(
+            last_modified=Max('updated_time'))['last_modified'],))
+    return {'last_modified': max(last_modified, pages_updated or
+                                 last_modified),
+            'pages': cache.get_versions([cache.PAGES])[0]}
+
+
+@memoize_on_request
+def article_state(request, year, month, slug, **kwargs):
+    # Served from the hot articles the view uses as well. Related posts
+    # bump the updated_time of the articles listing them.
+    article = cache.published_article(int(year), int(month), slug)
+    return navigation_state(article.updated_time if article else None)
+
+
+@memoize_on_request
+def page_state(request, slug, **kwargs):
+    return navigation_state(Page.objects.filter(
+        slug=slug, status=0).aggregate(
+            last_modified=Max('updated_time'))['last_modified'])
+
+
+def latest_update(model):
+    """The latest ``updated_time`` of ``model``, as a subquery."""
+    return RawSQL('SELECT MAX(updated_time) FROM %s' % model._meta.db_table,
+                  [], output_field=DateTimeField())
+
+
+@memoize_on_request
+def listing_state(request, *args, **kwargs):
+    # Unpublishing an article updates it and deleting one drops the count,
+    # so look at all articles and not only the published ones. Listings
+    # also show category and tag names and the pages in the sidebar, read
+    # in the same query.
+    state = Article.objects.aggregate(
+        last_modified=Max('updated_time'), count=Count('id'),
+        pages=Max(latest_update(Page)),
+        categories=Max(latest_update(Category)),
+        tags=Max(latest_update(Tag)))
+    if state['last_modified'] is not None:
+        state['last_modified'] = max(
+            state[key] for key in ('last_modified', 'pages', 'categories',
+                                   'tags') if state[key] is not None)
+    return state
+
+
+def state_condition(state_func):
+    def etag(request, *args, **kwargs):
+        state = state_func(request, *args, **kwargs)
+        if state['last_modified'] is None:
+            return None
+        return make_etag(*sorted(state.items()))
+
+    def last_modified(request, *args, **kwargs):
+        return state_func(request, *args, **kwargs)['last_modified']
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+article_condition = state_condition(article_state)
+page_condition = state_condition(page_state)
+listing_condition = state_condition(listing_state)
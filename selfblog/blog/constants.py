@@ -1,2 +1,57 @@
 # This is settings for current blog application
 ITEMS_PER_PAGE = 10
+# Pages are invalidated on write, the timeout only bounds stale entries.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Stampede protection of the cached pages, see blog.cache.lookup. Timeouts
+# are shortened by up to CACHE_TTL_JITTER so that pages cached together
+# don't expire together. Outdated pages are kept CACHE_STALE_TIMEOUT longer
+# and served while one request, holding a lock for at most
+# CACHE_LOCK_TIMEOUT seconds, renders them again. In the last
+# CACHE_EARLY_REFRESH_WINDOW of their life, a request renders them early
+# with a probability of CACHE_EARLY_REFRESH.
+CACHE_TTL_JITTER = 0.1
+CACHE_STALE_TIMEOUT = 60 * 60
+CACHE_LOCK_TIMEOUT = 30
+CACHE_EARLY_REFRESH_WINDOW = 0.1
+CACHE_EARLY_REFRESH = 0.05
+# markdown2 extras used to render articles and pages
+MARKDOWN_EXTRAS = ['fenced-code-blocks']
+# How many rendered sources are kept in memory
+RENDER_MEMO_SIZE = 128
+# Sidebar navigation and per-article summaries in listings, keyed on
+# versions and updated_time so they never serve stale content.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Listings show the part of an article before this marker, or else its
+# first EXCERPT_WORDS words.
+EXCERPT_SEPARATOR = '<!--more-->'
+EXCERPT_WORDS = 50
+# Highlighted code blocks kept in memory, and for how long they are kept in
+# the Django cache if BLOG_PERSISTENT_HIGHLIGHT_CACHE is set.
+HIGHLIGHT_CACHE_SIZE = 1024
+HIGHLIGHT_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+# Samples kept per URL name by the profiling middleware
+PROFILE_WINDOW = 1000
+# Most requested published articles kept in process memory by the detail
+# view. Writes invalidate them through the page cache versions, the timeout
+# bounds how long a cache outage may serve a stale one.
+HOT_ARTICLES = 128
+HOT_ARTICLE_TIMEOUT = 60
+# Related posts shown under an article. Shared tags count with a weight
+# that falls with the number of articles using the tag, the same category
+# adds RELATED_CATEGORY_WEIGHT. A write rescores at most RELATED_CANDIDATES
+# of the articles it is related to.
+RELATED_ARTICLES = 5
+RELATED_CATEGORY_WEIGHT = 0.5
+RELATED_CANDIDATES = 200
+# Articles on the popular posts page, ranked by their view counts.
+POPULAR_ARTICLES = 10
+# Articles fetched per query while streaming the archives page.
+ARCHIVE_CHUNK = 500
+# Primary keys covered by one sitemap file, at most 50000 URLs each.
+SITEMAP_CHUNK = 10000
+# Serialized feed entries are keyed on their content and never invalidated,
+# they only expire.
+FEED_ENTRY_TIMEOUT = 60 * 60 * 24 * 7
+# Items per page of the JSON API, clients may ask for up to API_MAX_ITEMS.
+API_ITEMS_PER_PAGE = 20
+API_MAX_ITEMS = 100
@@ -0,0 +1,25 @@
+# coding: utf-8
+from django.core.cache import cache as default_cache
+from django.utils.functional import SimpleLazyObject
+
+from . import cache
+from .constants import FRAGMENT_CACHE_TIMEOUT
+from .models import Page
+
+
+def navigation_pages():
+    """Published pages for the sidebar, cached until a page is written."""
+    key = 'blog:nav:%s' % cache.get_versions([cache.PAGES])[0]
+    pages = default_cache.get(key)
+    if pages is None:
+        pages = list(Page.objects.filter(status=0).values('slug', 'title'))
+        default_cache.set(key, pages, FRAGMENT_CACHE_TIMEOUT)
+    return pages
+
+
+def blog(request):
+    return {
+        # Lazy, so responses which don't render base.html skip the lookup.
+        'pages': SimpleLazyObject(navigation_pages),
+        'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
+    }
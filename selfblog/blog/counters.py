@@ -0,0 +1,148 @@
+# coding: utf-8
+"""Article view counts for the popular posts page.
+
+Every process adds up the views it served in memory and writes them at most
+every ``BLOG_VIEW_FLUSH_SECONDS`` from a background thread, in one
+``UPDATE ... SET views = views + CASE ...`` per batch. Hot articles are
+then updated a few times a minute instead of once per request, and as every
+process only adds its own increments, counts stay right with any number of
+workers. Views buffered when a process is killed are lost.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from . import cache
+from .models import Article, ArticleViewCount
+
+
+logger = logging.getLogger(__name__)
+
+# Articles updated per statement.
+BATCH_SIZE = 500
+
+
+def add_views(counts):
+    """Add ``counts``, ``{article pk: views}``, to the stored view counts.
+
+    Deleted articles are ignored.
+    """
+    pks = sorted(counts)
+    for first in range(0, len(pks), BATCH_SIZE):
+        batch = pks[first:first + BATCH_SIZE]
+        try:
+            _add_views(batch, counts)
+        except IntegrityError:
+            # Another process created a missing row first, it exists now.
+            _add_views(batch, counts)
+
+
+def _add_views(pks, counts):
+    with transaction.atomic():
+        existing = list(ArticleViewCount.objects.filter(
+            article_id__in=pks).values_list('article_id', flat=True))
+        if existing:
+            ArticleViewCount.objects.filter(article_id__in=existing).update(
+                views=F('views') + Case(
+                    *[When(article_id=pk, then=Value(counts[pk]))
+                      for pk in existing],
+                    output_field=PositiveIntegerField()))
+        missing = Article.objects.filter(pk__in=set(pks) - set(existing))
+        ArticleViewCount.objects.bulk_create(
+            [ArticleViewCount(article_id=pk, views=counts[pk])
+             for pk in missing.values_list('pk', flat=True)])
+
+
+class ViewBuffer(object):
+    """Views served by this process which are not written yet."""
+
+    def __init__(self):
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, pk):
+        interval = getattr(settings, 'BLOG_VIEW_FLUSH_SECONDS', 0)
+        with self._lock:
+            self._pending[pk] += 1
+            # Started lazily, threads don't survive the fork of the workers.
+            if interval and (self._thread is None or
+                             not self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval,),
+                    name='blog-view-counts', daemon=True)
+                self._thread.start()
+        if not interval:
+            try:
+                self.flush()
+            except Exception:
+                # Written with the next view, the page is served anyway.
+                logger.exception('Could not write the article view counts.')
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Write the buffered views, return how many were written."""
+        with self._lock:
+            counts, self._pending = self._pending, Counter()
+        if not counts:
+            return 0
+        try:
+            add_views(counts)
+        except Exception:
+            # Keep them for the next try.
+            with self._lock:
+                self._pending.update(counts)
+            raise
+        cache.invalidate(cache.POPULAR)
+        return sum(counts.values())
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write the article view counts.')
+            finally:
+                close_old_connections()
+
+
+view_buffer = ViewBuffer()
+
+
+@atexit.register
+def flush_at_exit():
+    try:
+        view_buffer.flush()
+    except Exception:
+        logger.exception('Lost the buffered article view counts.')
+
+
+def count_views(view):
+    """Count the views of the article detail view.
+
+    Wraps the page cache and the conditional GET handling, which answer
+    most requests without running the view.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if (request.method == 'GET' and response.status_code in (200, 304) and
+                getattr(settings, 'BLOG_COUNT_VIEWS', False)):
+            # Served from the hot articles, like the view itself.
+            article = cache.published_article(
+                int(kwargs['year']), int(kwargs['month']), kwargs['slug'])
+            if article is not None:
+                view_buffer.record(article.pk)
+        return response
+    return wrapper
@@ -0,0 +1,331 @@
+# coding: utf-8
+"""Render the public site into a directory a plain web server can serve.
+
+Every URL of ``blog.urls`` is requested through the regular Django stack and
+written to a file named after its path:
+
+* ``/archives/`` becomes ``archives/index.html``,
+* ``/archives/2017/1/`` becomes ``archives/2017/1/index.html``,
+* ``/post/2017/1/hello`` becomes ``post/2017/1/hello.html``,
+* ``/feeds/atom/`` becomes ``feeds/atom/index.xml``, and likewise the feeds
+  of categories and tags,
+* page N of a listing becomes ``<listing>/p/N/index.html``, and the
+  ``?page=N`` links in the HTML are rewritten to match.
+
+nginx can serve the result with ``try_files $uri $uri.html $uri/ =404`` and
+``index index.html index.xml``.
+
+A manifest stored next to the files remembers when and what was exported,
+which lets an incremental export rewrite only the pages affected by rows
+updated since then.
+"""
+import json
+import math
+import multiprocessing
+import os
+import re
+import shutil
+from collections import defaultdict
+
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from .constants import ITEMS_PER_PAGE
+from .models import Category, Article, Page, Tag
+
+
+MANIFEST = '.export-manifest.json'
+
+PAGE_LINK_RE = re.compile(r'href="\?page=(\d+)"')
+
+
+def page_url(listing_url, number):
+    if number == 1:
+        return listing_url
+    return '%sp/%d/' % (listing_url, number)
+
+
+def file_path(url, content_type):
+    path = url.lstrip('/')
+    if not path or path.endswith('/'):
+        index = 'index.xml' if 'xml' in content_type else 'index.html'
+        return path + index
+    return path + '.html'
+
+
+def listing_urls(listing_url, count):
+    """Return the URLs of every page of a listing with ``count`` articles."""
+    pages = max(1, int(math.ceil(count / float(ITEMS_PER_PAGE))))
+    return [(page_url(listing_url, number), listing_url, number)
+            for number in range(1, pages + 1)]
+
+
+class SiteState(object):
+    """What the published site consists of right now."""
+
+    def __init__(self):
+        self.articles = {}
+        articles = Article.published.values_list(
+            'pk', 'slug', 'published_time', 'category__slug')
+        for pk, slug, published_time, category in articles:
+            self.articles[pk] = {
+                'url': reverse('blog:detail', args=[
+                    published_time.year, published_time.month, slug]),
+                'category': category,
+                'tags': [],
+                'month': '%d/%d' % (published_time.year,
+                                    published_time.month),
+            }
+        tagged = Article.tags.through.objects.filter(
+            article__status=0).values_list('article_id', 'tag__slug')
+        for pk, tag in tagged:
+            self.articles[pk]['tags'].append(tag)
+        for article in self.articles.values():
+            article['tags'].sort()
+
+        self.pages = dict(
+            (str(pk), reverse('blog:page', args=[slug])) for pk, slug in
+            Page.objects.filter(status=0).values_list('pk', 'slug'))
+        self.articles = dict((str(pk), article)
+                             for pk, article in self.articles.items())
+
+    def category_counts(self):
+        counts = defaultdict(int)
+        for article in self.articles.values():
+            counts[article['category']] += 1
+        return counts
+
+    def tag_counts(self):
+        counts = defaultdict(int)
+        for article in self.articles.values():
+            for tag in article['tags']:
+                counts[tag] += 1
+        return counts
+
+    def month_counts(self):
+        counts = defaultdict(int)
+        for article in self.articles.values():
+            counts[article['month']] += 1
+        return counts
+
+
+def global_urls(state):
+    urls = listing_urls(reverse('blog:index'), len(state.articles))
+    urls.extend((reverse(name), None, None) for name in
+                ('blog:popular', 'blog:archives', 'blog:categories',
+                 'blog:tags'))
+    urls.append(('/feeds/atom/', None, None))
+    return urls
+
+
+def taxonomy_urls(url_name, counts, slugs):
+    """Return the listing pages and feeds of ``slugs`` and the listings and
+    feeds left empty."""
+    urls, empty = [], []
+    for slug in slugs:
+        listing_url = reverse(url_name, args=[slug])
+        feed_url = reverse(url_name + '_feed', args=[slug])
+        if counts.get(slug):
+            urls.extend(listing_urls(listing_url, counts[slug]))
+            urls.append((feed_url, None, None))
+        else:
+            empty.extend([listing_url, feed_url])
+    return urls, empty
+
+
+def archive_urls(counts, months):
+    """Return every year archive and the listing pages of the archive
+    ``months``, ``'<year>/<month>'``, and the archives left empty."""
+    years = set(key.split('/')[0] for key in counts)
+    urls = [(reverse('blog:archive_year', args=[year]), None, None)
+            for year in sorted(years)]
+    empty = []
+    for key in months:
+        year, month = key.split('/')
+        listing_url = reverse('blog:archive_month', args=[year, month])
+        if counts.get(key):
+            urls.extend(listing_urls(listing_url, counts[key]))
+        else:
+            empty.append(listing_url)
+            if year not in years:
+                empty.append(reverse('blog:archive_year', args=[year]))
+    return urls, empty
+
+
+def plan(state, manifest=None):
+    """Return the URLs to render and the stale URLs whose files must go.
+
+    URLs are ``(url, listing_url, page_number)`` tuples, the last two are
+    None unless the URL is a page of a paginated listing.
+    """
+    if manifest is None:
+        urls = global_urls(state)
+        counts = state.category_counts()
+        urls.extend(taxonomy_urls('blog:category', counts, counts)[0])
+        counts = state.tag_counts()
+        urls.extend(taxonomy_urls('blog:tag', counts, counts)[0])
+        counts = state.month_counts()
+        urls.extend(archive_urls(counts, counts)[0])
+        urls.extend((a['url'], None, None) for a in state.articles.values())
+        urls.extend((url, None, None) for url in state.pages.values())
+        return urls, []
+
+    since = parse_datetime(manifest['exported_at'])
+    old_articles = manifest['articles']
+    old_pages = manifest['pages']
+
+    # The navigation of every page lists the published pages.
+    if (state.pages != old_pages or Page.objects.filter(
+            updated_time__gt=since).exists()):
+        urls, stale = plan(state)
+        current = set(url for url, listing, number in urls)
+        stale = [a['url'] for a in old_articles.values()
+                 if a['url'] not in current]
+        stale.extend(url for url in old_pages.values() if url not in current)
+        return urls, stale
+
+    updated = set(str(pk) for pk in Article.objects.filter(
+        updated_time__gt=since).values_list('pk', flat=True))
+    changed = set(pk for pk in state.articles if
+                  pk in updated or state.articles[pk] != old_articles.get(pk))
+    removed = set(old_articles) - set(state.articles)
+
+    categories = set(Category.objects.filter(
+        updated_time__gt=since).values_list('slug', flat=True))
+    tags = set(Tag.objects.filter(
+        updated_time__gt=since).values_list('slug', flat=True))
+    months = set()
+    for pk in changed | removed:
+        for article in (state.articles.get(pk), old_articles.get(pk)):
+            if article:
+                categories.add(article['category'])
+                tags.update(article['tags'])
+                # Manifests of older exports have no months.
+                if 'month' in article:
+                    months.add(article['month'])
+
+    urls = []
+    if changed or removed or categories or tags:
+        urls.extend(global_urls(state))
+    category_pages, empty_categories = taxonomy_urls(
+        'blog:category', state.category_counts(), categories)
+    tag_pages, empty_tags = taxonomy_urls(
+        'blog:tag', state.tag_counts(), tags)
+    urls.extend(category_pages + tag_pages)
+    empty_months = []
+    if months:
+        month_pages, empty_months = archive_urls(state.month_counts(), months)
+        urls.extend(month_pages)
+    urls.extend((state.articles[pk]['url'], None, None) for pk in changed)
+
+    current = set(url for url, listing, number in urls)
+    current.update(a['url'] for a in state.articles.values())
+    stale = [old_articles[pk]['url'] for pk in removed]
+    stale.extend(empty_categories + empty_tags + empty_months)
+    stale = [url for url in set(stale) if url not in current]
+    return urls, stale
+
+
+def render_urls(urls, outdir, base_url):
+    """Request ``urls`` and write the responses below ``outdir``.
+
+    Return a list of ``(url, file path, status code)``.
+    """
+    parts = urlsplit(base_url)
+    client = Client(HTTP_HOST=parts.netloc)
+    secure = parts.scheme == 'https'
+    written = []
+    with override_settings(ALLOWED_HOSTS=[parts.netloc.split(':')[0]],
+                           BLOG_PAGE_CACHE=False,
+                           BLOG_CURSOR_PAGINATION=False,
+                           BLOG_COUNT_VIEWS=False):
+        for url, listing_url, number in urls:
+            if number:
+                response = client.get(listing_url, {'page': number},
+                                      secure=secure)
+            else:
+                response = client.get(url, secure=secure)
+            if response.status_code != 200:
+                written.append((url, None, response.status_code))
+                continue
+            content = response.getvalue()
+            if listing_url is not None:
+                content = PAGE_LINK_RE.sub(
+                    lambda m: 'href="%s"' % page_url(listing_url,
+                                                     int(m.group(1))),
+                    content.decode(response.charset)).encode(
+                        response.charset)
+            path = file_path(url, response['Content-Type'])
+            full_path = os.path.join(outdir, path)
+            directory = os.path.dirname(full_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(full_path, 'wb') as f:
+                f.write(content)
+            written.append((url, path, 200))
+    return written
+
+
+def _render_chunk(args):
+    return render_urls(*args)
+
+
+def remove_url(outdir, url):
+    for path in (file_path(url, 'text/html'), file_path(url, 'xml')):
+        full_path = os.path.join(outdir, path)
+        if os.path.isfile(full_path):
+            os.remove(full_path)
+    if url.endswith('/'):
+        shutil.rmtree(os.path.join(outdir, url.lstrip('/'), 'p'),
+                      ignore_errors=True)
+
+
+def export(outdir, base_url, incremental=False, workers=1):
+    """Export the site to ``outdir``, return ``(written, removed)``."""
+    manifest_path = os.path.join(outdir, MANIFEST)
+    manifest = None
+    if incremental and os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('base_url') != base_url:
+            manifest = None
+
+    started = timezone.now()
+    state = SiteState()
+    urls, stale = plan(state, manifest)
+
+    for url in stale:
+        remove_url(outdir, url)
+    # Listings may have fewer pages than last time.
+    for url, listing_url, number in urls:
+        if number == 1:
+            remove_url(outdir, url)
+
+    if workers > 1 and len(urls) > 1:
+        # Every worker opens its own database connection.
+        connections.close_all()
+        chunks = [(urls[i::workers], outdir, base_url)
+                  for i in range(workers)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            written = [row for chunk in pool.map(_render_chunk, chunks)
+                       for row in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        written = render_urls(urls, outdir, base_url)
+
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'exported_at': started.isoformat(),
+            'base_url': base_url,
+            'articles': state.articles,
+            'pages': state.pages,
+        }, f)
+    return written, stale
@@ -1,28 +1,175 @@
-from django.contrib.syndication.views import Feed
+# coding: utf-8
+import hashlib
+from collections import OrderedDict
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.http import Http404, HttpResponse
 from django.urls import reverse
-from django.utils.feedgenerator import Atom1Feed
+from django.utils.encoding import force_bytes, iri_to_uri
+from django.utils import timezone
+from django.utils.feedgenerator import Atom1Feed, rfc3339_date
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from . import cache
+from .constants import FEED_ENTRY_TIMEOUT
+from .models import Category, Article, Tag
+
+
+def feed_items():
+    return getattr(settings, 'BLOG_FEED_ITEMS', 20)
+
+
+def entry_xml(feed, item):
+    """Serialize one ``<entry>`` of ``feed``, but its closing tag.
+
+    ``<updated>`` is left to ``close_entry``, the updated_time of an article
+    also moves when only the related articles of its page changed.
+    """
+    stream = StringIO()
+    handler = SimplerXMLGenerator(stream, 'utf-8')
+    handler.startElement('entry', feed.item_attributes(item))
+    feed.add_item_elements(handler, item)
+    return stream.getvalue()
 
-from .models import Article
 
+def close_entry(updated):
+    return '<updated>%s</updated></entry>' % rfc3339_date(updated)
 
-class BlogFeed(Feed):
+
+class CachedEntriesFeed(Atom1Feed):
+    """``Atom1Feed`` dated by the ``updated`` time of its entries, most of
+    them are serialized from the cache and not among its items."""
+
+    def __init__(self, *args, **kwargs):
+        self.updated = kwargs.pop('updated')
+        super(CachedEntriesFeed, self).__init__(*args, **kwargs)
+
+    def latest_post_date(self):
+        return self.updated or timezone.now()
+
+
+class BlogFeed(object):
+    """Atom feed of the latest ``BLOG_FEED_ITEMS`` published articles.
+
+    Every entry is serialized once per version of its article and reused
+    by all feeds it appears in. The whole document is cached until one of
+    the ``scopes`` of the feed is invalidated.
+    """
     title = "tntC4stl3's blog"
-    link = "/"
+    author_name = 'tntC4stl3'
+    scopes = [cache.ARTICLES]
+
+    def get_object(self, **kwargs):
+        return None
+
+    def get_title(self, obj):
+        return self.title
+
+    def get_link(self, obj):
+        return reverse('blog:index')
+
+    def items(self, obj):
+        return Article.published.all()
+
+    def __call__(self, request, **kwargs):
+        base = '%s://%s' % (request.scheme, request.get_host())
+        scopes = [cache.SITE] + [scope.format(**kwargs)
+                                 for scope in self.scopes]
+        key = 'blog:feed:%s' % hashlib.md5(force_bytes(
+            base + request.path)).hexdigest()
+        content = cache.cached(key, scopes, lambda: self.render(
+            request, base, self.get_object(**kwargs)))
+        return HttpResponse(content,
+                            content_type='application/xml; charset=utf-8')
+
+    def render(self, request, base, obj):
+        latest = list(self.items(obj).order_by(
+            '-published_time', '-pk').values_list(
+                'pk', 'title', 'slug', 'content_hash', 'published_time',
+                'updated_time')[:feed_items()])
+        feed = CachedEntriesFeed(
+            title=self.get_title(obj),
+            link=iri_to_uri(base + self.get_link(obj)),
+            description='', feed_url=iri_to_uri(base + request.path),
+            language=settings.LANGUAGE_CODE,
+            updated=max([row[-1] for row in latest] or [None]))
+
+        # Keyed on what the entry shows, without updated_time.
+        keys = OrderedDict((row[0], 'blog:feed:open-entry:%s' % hashlib.md5(
+            force_bytes('|'.join([base] + [
+                str(value) for value in row[:-1]]))).hexdigest())
+            for row in latest)
+        entries = default_cache.get_many(list(keys.values()))
+        missing = [pk for pk, key in keys.items() if key not in entries]
+        if missing:
+            excerpts = dict(Article.objects.filter(pk__in=missing).values_list(
+                'pk', 'excerpt_html'))
+            new = {}
+            for pk, title, slug, digest, published_time, updated in latest:
+                if pk not in excerpts:
+                    continue
+                link = iri_to_uri(base + reverse('blog:detail', args=[
+                    published_time.year, published_time.month, slug]))
+                feed.add_item(title=title, link=link,
+                              description=excerpts[pk], unique_id=link,
+                              pubdate=published_time,
+                              author_name=self.author_name)
+                new[keys[pk]] = entry_xml(feed, feed.items[-1])
+            default_cache.set_many(new, FEED_ENTRY_TIMEOUT)
+            entries.update(new)
+
+        stream = StringIO()
+        handler = SimplerXMLGenerator(stream, 'utf-8')
+        handler.startDocument()
+        handler.startElement('feed', feed.root_attributes())
+        feed.add_root_elements(handler)
+        # The generator writes straight to the stream, entries can be
+        # added in between.
+        for row in latest:
+            key = keys[row[0]]
+            if key in entries:
+                stream.write(entries[key])
+                stream.write(close_entry(row[-1]))
+        handler.endElement('feed')
+        return stream.getvalue()
+
+
+class CategoryFeed(BlogFeed):
+    scopes = ['category:{slug}']
+
+    def get_object(self, slug):
+        category = Category.objects.filter(slug=slug).only(
+            'name', 'slug').first()
+        if category is None:
+            raise Http404
+        return category
+
+    def get_title(self, obj):
+        return '%s - %s' % (self.title, obj.name)
+
+    def get_link(self, obj):
+        return reverse('blog:category', args=[obj.slug])
+
+    def items(self, obj):
+        return Article.published.filter(category=obj)
 
-    feed_type = Atom1Feed
-    mime_type = 'application/xml'
 
-    def items(self):
-        return Article.objects.filter(status=0)
+class TagFeed(BlogFeed):
+    scopes = ['tag:{slug}']
 
-    def item_link(self, item):
-        return reverse('blog:detail', args=[item.year, item.month, item.slug])
+    def get_object(self, slug):
+        tag = Tag.objects.filter(slug=slug).only('name', 'slug').first()
+        if tag is None:
+            raise Http404
+        return tag
 
-    def item_pubdate(self, item):
-        return item.published_time
+    def get_title(self, obj):
+        return '%s - %s' % (self.title, obj.name)
 
-    def item_updatedate(self, item):
-        return item.updated_time
+    def get_link(self, obj):
+        return reverse('blog:tag', args=[obj.slug])
 
-    def item_author_name(self):
-        return "tntC4stl3"
+    def items(self, obj):
+        return Article.published.filter(tags=obj)
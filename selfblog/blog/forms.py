@@ -21,9 +21,7 @@ class TagsField(forms.CharField):
     widget = TagWidget
 
     def clean(self, value):
-        tagwords = [o.strip() for o in value.split(',') if o.strip()]
-        return [Tag.objects.get_or_create(name=t.lower(), slug=t.lower())[0]
-                for t in set(tagwords)]
+        return Tag.objects.resolve(value.split(','))
 
 
 class ArticleForm(forms.ModelForm):
@@ -0,0 +1,217 @@
+# coding: utf-8
+"""Import a directory of Markdown files with front matter as articles.
+
+A file looks like::
+
+    ---
+    title: Hello world
+    slug: hello-world
+    category: Python
+    tags: django, web
+    date: 2017-01-05 10:00
+    status: publish
+    ---
+    The markdown content.
+
+Only ``title`` and ``category`` are required, the slug defaults to the file
+name, ``status`` to publish and ``date`` to the time of the import.
+Articles are matched by slug, so importing the same files again updates
+them instead of creating duplicates.
+"""
+import io
+import os
+import re
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import related, search
+from .bulk import bulk_update
+from .models import STATUS, Category, Article, Tag, ArchiveMonth
+
+
+FRONT_MATTER_RE = re.compile(r'\A---\s*\n(.*?)\n---\s*\n?(.*)\Z', re.DOTALL)
+STATUS_NAMES = dict((name.lower(), value) for value, name in STATUS.items())
+# Category slugs may not contain dashes, see blog/urls.py.
+CATEGORY_SLUG_RE = re.compile(r'\W+', re.UNICODE)
+
+
+class FrontMatterError(ValueError):
+    pass
+
+
+def parse_value(value):
+    value = value.strip()
+    if value.startswith('[') and value.endswith(']'):
+        return [v.strip().strip('\'"') for v in value[1:-1].split(',')
+                if v.strip()]
+    return value.strip('\'"')
+
+
+def parse_file(path):
+    """Return the article fields of the Markdown file at ``path``."""
+    with io.open(path, encoding='utf-8') as f:
+        text = f.read()
+    match = FRONT_MATTER_RE.match(text)
+    if not match:
+        raise FrontMatterError('%s has no front matter' % path)
+    meta = {}
+    for line in match.group(1).splitlines():
+        if line.strip() and not line.lstrip().startswith('#'):
+            key, sep, value = line.partition(':')
+            if not sep:
+                raise FrontMatterError('%s: invalid front matter line %r' % (
+                    path, line))
+            meta[key.strip().lower()] = parse_value(value)
+
+    for key in ('title', 'category'):
+        if not meta.get(key):
+            raise FrontMatterError('%s has no %s' % (path, key))
+    tags = meta.get('tags', [])
+    if not isinstance(tags, list):
+        tags = tags.split(',')
+
+    status = meta.get('status', 'publish')
+    if status.lower() in STATUS_NAMES:
+        status = STATUS_NAMES[status.lower()]
+    elif status.isdigit() and int(status) in STATUS:
+        status = int(status)
+    else:
+        raise FrontMatterError('%s: unknown status %r' % (path, status))
+
+    published_time = None
+    if meta.get('date'):
+        published_time = parse_datetime(meta['date'].replace(' ', 'T'))
+        if published_time is None:
+            date = parse_date(meta['date'])
+            if date is None:
+                raise FrontMatterError('%s: invalid date %r' % (
+                    path, meta['date']))
+            published_time = parse_datetime(date.isoformat() + 'T00:00')
+        if timezone.is_naive(published_time):
+            published_time = timezone.make_aware(published_time)
+
+    return {
+        'title': meta['title'],
+        'slug': meta.get('slug') or os.path.splitext(
+            os.path.basename(path))[0],
+        'category': meta['category'],
+        'tags': [tag for tag in tags if tag.strip()],
+        'status': status,
+        'published_time': published_time,
+        'content': match.group(2),
+    }
+
+
+def find_files(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files
+                     if name.endswith(('.md', '.markdown')))
+    return sorted(paths)
+
+
+def resolve_categories(names):
+    """Return ``{name: category}``, creating the missing ones."""
+    names = set(names)
+    categories = dict((c.name, c) for c in
+                      Category.objects.filter(name__in=names))
+    missing = sorted(names - set(categories))
+    if missing:
+        Category.objects.bulk_create(
+            [Category(name=name,
+                      slug=CATEGORY_SLUG_RE.sub('', name.lower()) or 'misc')
+             for name in missing])
+        categories.update((c.name, c) for c in
+                          Category.objects.filter(name__in=missing))
+    return categories
+
+
+def import_chunk(entries):
+    """Create or update the articles of ``entries`` in one transaction.
+
+    ``entries`` are the fields from ``parse_file`` plus the rendered
+    ``content_hash``, ``content_html`` and ``excerpt_html``. Return
+    ``(created, updated)`` lists of primary keys.
+    """
+    with transaction.atomic():
+        categories = resolve_categories(e['category'] for e in entries)
+        tags = dict((tag.name.lower(), tag) for tag in Tag.objects.resolve(
+            [name for e in entries for name in e['tags']]))
+
+        slugs = [e['slug'] for e in entries]
+        existing = {}
+        for article in Article.objects.filter(slug__in=slugs).order_by(
+                'published_time').prefetch_related('tags'):
+            # The latest article wins if a slug is used more than once.
+            existing[article.slug] = article
+
+        now = timezone.now()
+        new, updates, tag_rows = [], {}, {}
+        for e in entries:
+            fields = {
+                'title': e['title'],
+                'content': e['content'],
+                'content_hash': e['content_hash'],
+                'content_html': e['content_html'],
+                'excerpt_html': e['excerpt_html'],
+                'category_id': categories[e['category']].pk,
+                'status': e['status'],
+            }
+            tag_ids = sorted(tags[n.strip().lower()].pk for n in e['tags'])
+            article = existing.get(e['slug'])
+            if article is None:
+                new.append((Article(slug=e['slug'], **fields), e))
+                continue
+            fields['published_time'] = (e['published_time'] or
+                                        article.published_time)
+            unchanged = all(getattr(article, name) == value
+                            for name, value in fields.items()) and \
+                sorted(t.pk for t in article.tags.all()) == tag_ids
+            if not unchanged:
+                fields['updated_time'] = now
+                updates[article.pk] = fields
+                tag_rows[article.pk] = tag_ids
+
+        bulk_update(Article, updates, ['title', 'content', 'content_hash',
+                                       'content_html', 'excerpt_html',
+                                       'category_id', 'status',
+                                       'published_time', 'updated_time'])
+
+        created = []
+        if new:
+            Article.objects.bulk_create([article for article, e in new])
+            pks = dict(Article.objects.filter(
+                slug__in=[article.slug for article, e in new]).order_by(
+                    'published_time').values_list('slug', 'pk'))
+            # published_time is set on insert, dates from the files
+            # are written afterwards.
+            bulk_update(Article, dict(
+                (pks[e['slug']], {'published_time': e['published_time']})
+                for article, e in new if e['published_time']),
+                ['published_time'])
+            for article, e in new:
+                pk = pks[e['slug']]
+                created.append(pk)
+                tag_rows[pk] = [tags[n.strip().lower()].pk
+                                for n in e['tags']]
+
+        Tagged = Article.tags.through
+        Tagged.objects.filter(article_id__in=list(updates)).delete()
+        Tagged.objects.bulk_create(
+            [Tagged(article_id=pk, tag_id=tag_id)
+             for pk, tag_ids in tag_rows.items() for tag_id in set(tag_ids)])
+    return created, list(updates)
+
+
+def finish(pks):
+    """Bring the search index, related posts, published counts, archives
+    index and caches up to date after importing the articles ``pks``, which
+    skipped the model signals."""
+    search.index_articles(Article.objects.filter(pk__in=pks))
+    Category.objects.recount()
+    Tag.objects.recount()
+    ArchiveMonth.objects.rebuild()
+    # Invalidates the page cache as well.
+    related.rebuild()
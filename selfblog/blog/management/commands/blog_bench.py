@@ -0,0 +1,100 @@
+# coding: utf-8
+import json
+import platform
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from blog import bench
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every public URL on a synthetic blog created in a '
+            'throwaway test database and compare against a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=1000,
+                            help='Number of generated articles.')
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--tags', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per route.')
+        parser.add_argument('--page-cache', action='store_true',
+                            help='Serve pages from the page cache, by '
+                                 'default the views themselves are timed.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output',
+                            help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline',
+                            help='Fail if the results regress from this '
+                                 'JSON file of an earlier run.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative growth of latency and '
+                                 'memory over the baseline.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['views']
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           serialize=False)
+        # Like the database, the cache is a private one, the configured
+        # one may hold the pages of the live site.
+        private_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'blog-bench',
+        }})
+        private_cache.enable()
+        try:
+            start = time.time()
+            bench.generate_corpus(options['articles'], options['categories'],
+                                  options['tags'], options['seed'])
+            self.stdout.write('Generated %d articles in %.1fs' % (
+                options['articles'], time.time() - start))
+            results = bench.run(options['requests'],
+                                page_cache=options['page_cache'],
+                                seed=options['seed'])
+        finally:
+            cache.clear()
+            private_cache.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write('%-12s %9s %9s %9s %9s %8s %10s' % (
+            'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries',
+            'peak KB'))
+        for name, stats in sorted(results.items()):
+            self.stdout.write('%-12s %9.2f %9.2f %9.2f %9.1f %8s %10.1f' % (
+                name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['rps'], stats['queries'], stats['peak_kb']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'meta': {
+                        'articles': options['articles'],
+                        'categories': options['categories'],
+                        'tags': options['tags'],
+                        'requests': options['requests'],
+                        'page_cache': options['page_cache'],
+                        'python': platform.python_version(),
+                        'django': django.get_version(),
+                        'database': connection.vendor,
+                    },
+                    'views': results,
+                }, f, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            regressions = bench.compare(results, baseline,
+                                        options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions over the baseline:\n' +
+                                   '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(
+                'No regressions over the baseline.'))
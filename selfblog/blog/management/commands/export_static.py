@@ -0,0 +1,51 @@
+# coding: utf-8
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.export import export
+
+
+class Command(BaseCommand):
+    help = ('Render every public page of the blog into OUTDIR so that a '
+            'plain web server can serve it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('outdir')
+        parser.add_argument('--base-url', default='http://localhost',
+                            help='Scheme and host used for absolute links, '
+                                 'e.g. in the Atom feed.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rewrite pages affected by rows '
+                                 'updated since the last export.')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of rendering processes.')
+
+    def handle(self, *args, **options):
+        outdir = options['outdir']
+        if os.path.exists(outdir) and not os.path.isdir(outdir):
+            raise CommandError('%s is not a directory.' % outdir)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        start = time.time()
+        written, removed = export(outdir, options['base_url'].rstrip('/'),
+                                  incremental=options['incremental'],
+                                  workers=options['workers'])
+        for url, path, status in written:
+            if path is None:
+                self.stderr.write('%s returned %d, skipped' % (url, status))
+            elif options['verbosity'] > 1:
+                self.stdout.write('%s -> %s' % (url, path))
+        for url in removed:
+            self.stdout.write('%s removed' % url)
+
+        elapsed = time.time() - start
+        count = len([row for row in written if row[1]])
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote %d files, removed %d in %.2fs (%.1f pages/s)' % (
+                count, len(removed), elapsed,
+                count / elapsed if elapsed else 0)))
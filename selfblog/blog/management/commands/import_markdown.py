@@ -0,0 +1,72 @@
+# coding: utf-8
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import importer
+from blog.rendering import render_rows
+
+
+class Command(BaseCommand):
+    help = ('Import a directory of Markdown files with front matter as '
+            'articles, updating the ones with the same slug.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Files rendered and written per batch.')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of rendering processes.')
+
+    def handle(self, *args, **options):
+        paths = importer.find_files(options['directory'])
+        if not paths:
+            raise CommandError('No .md files in %s' % options['directory'])
+        batch_size = options['batch_size']
+        workers = options['workers']
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+
+        start = time.time()
+        created, updated = [], []
+        try:
+            for first in range(0, len(paths), batch_size):
+                try:
+                    entries = [importer.parse_file(path) for path in
+                               paths[first:first + batch_size]]
+                except importer.FrontMatterError as e:
+                    raise CommandError(str(e))
+                sources = list(enumerate(e['content'] for e in entries))
+                if pool:
+                    size = len(sources) // workers + 1
+                    chunks = pool.map(render_rows, [
+                        sources[i:i + size]
+                        for i in range(0, len(sources), size)])
+                    rendered = [row for chunk in chunks for row in chunk]
+                else:
+                    rendered = render_rows(sources)
+                for i, digest, html, excerpt in rendered:
+                    entries[i].update(content_hash=digest, content_html=html,
+                                      excerpt_html=excerpt)
+
+                new, changed = importer.import_chunk(entries)
+                created.extend(new)
+                updated.extend(changed)
+                seen = first + len(entries)
+                elapsed = time.time() - start
+                self.stdout.write('%d/%d files imported (%.1f rows/s)' % (
+                    seen, len(paths), seen / elapsed if elapsed else 0))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        if created or updated:
+            importer.finish(created + updated)
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            '%d created, %d updated, %d unchanged in %.2fs (%.1f rows/s)' % (
+                len(created), len(updated),
+                len(paths) - len(created) - len(updated), elapsed,
+                len(paths) / elapsed if elapsed else 0)))
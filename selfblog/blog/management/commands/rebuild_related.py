@@ -0,0 +1,22 @@
+# coding: utf-8
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.related import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of all published articles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows written per insert.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = rebuild(batch_size=options['batch_size'])
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            'Related posts of %d articles in %.2fs (%.1f articles/s)' % (
+                count, elapsed, count / elapsed if elapsed else 0)))
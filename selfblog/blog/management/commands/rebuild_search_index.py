@@ -0,0 +1,25 @@
+# coding: utf-8
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Article, SearchDocument
+from blog.search import index_articles
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of all published articles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Articles indexed per transaction.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        SearchDocument.objects.all().delete()
+        count = index_articles(Article.published.all(),
+                               batch_size=options['batch_size'])
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d articles in %.2fs (%.1f articles/s)' % (
+                count, elapsed, count / elapsed if elapsed else 0)))
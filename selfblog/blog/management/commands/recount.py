@@ -0,0 +1,41 @@
+# coding: utf-8
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import cache, sitemaps
+from blog.models import Category, Tag, ArchiveMonth
+
+
+class Command(BaseCommand):
+    help = ('Recompute the published article counts of categories and tags, '
+            'repair the ones which drifted, and rebuild the archives index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows recounted per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        start = time.time()
+        for model in (Category, Tag):
+            name = model._meta.verbose_name_plural
+            last_pk = seen = fixed = 0
+            while True:
+                pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+                    'pk').values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                last_pk = pks[-1]
+                seen += len(pks)
+                fixed += model.objects.filter(pk__in=pks).recount()
+                cache.invalidate(*sitemaps.chunk_scopes(model, pks))
+            self.stdout.write('%s: %d recounted, %d fixed' % (
+                name, seen, fixed))
+
+        months = ArchiveMonth.objects.rebuild()
+        self.stdout.write('Archives: %d months' % months)
+
+        cache.invalidate(cache.ARTICLES)
+        self.stdout.write(self.style.SUCCESS(
+            'Recounted in %.2fs' % (time.time() - start)))
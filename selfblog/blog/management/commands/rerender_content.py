@@ -0,0 +1,128 @@
+# coding: utf-8
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog import cache, search
+from blog.bulk import bulk_update
+from blog.models import Article, Page
+from blog.rendering import (content_hash, highlight_cache,
+                            render_rows_with_stats)
+
+
+class Command(BaseCommand):
+    help = ('Re-render the HTML of articles and pages whose markdown source '
+            'or renderer configuration changed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all',
+                            help='Re-render every row, not only stale ones.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Rows rendered and written per batch.')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of rendering processes.')
+
+    def handle(self, *args, **options):
+        self.force = options['all']
+        self.batch_size = options['batch_size']
+        workers = options['workers']
+
+        self.workers = workers
+        self.pool = multiprocessing.Pool(workers) if workers > 1 else None
+        # Latest highlight cache statistics of every rendering process, this
+        # one may have highlighted blocks before the command started.
+        before = highlight_cache.stats()
+        self.highlight_stats = {before['pid']: before}
+        try:
+            changed = sum(self.rerender(model) for model in (Article, Page))
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+
+        if changed:
+            cache.invalidate_all()
+
+        hits = sum(s['hits'] for s in self.highlight_stats.values()) - \
+            before['hits']
+        misses = sum(s['misses'] for s in self.highlight_stats.values()) - \
+            before['misses']
+        self.stdout.write('Highlighted code blocks: %d cached, %d rendered' % (
+            hits, misses))
+
+    def batches(self, model):
+        """Yield lists of (pk, content) of the rows which need rendering."""
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', 'content', 'content_hash')[
+                    :self.batch_size])
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+            stale = [(pk, content) for pk, content, digest in rows
+                     if self.force or digest != content_hash(content)]
+            if stale:
+                yield stale
+
+    def render(self, rows):
+        """Render a batch, split over the worker processes."""
+        if not self.pool:
+            results = [render_rows_with_stats(rows)]
+        else:
+            size = len(rows) // self.workers + 1
+            chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+            results = self.pool.map(render_rows_with_stats, chunks)
+        rendered = []
+        for chunk, stats in results:
+            self.highlight_stats[stats['pid']] = stats
+            rendered.extend(chunk)
+        return rendered
+
+    def rerender(self, model):
+        name = model._meta.verbose_name_plural
+        total = model.objects.count()
+        seen = changed = 0
+        start = time.time()
+
+        for batch in self.batches(model):
+            rendered = self.render(batch)
+            pks = [pk for pk, digest, html, excerpt in rendered]
+            fields = ['content_html', 'content_hash', 'updated_time']
+            if model is Article:
+                fields.append('excerpt_html')
+            old = dict((values['pk'], values) for values in
+                       model.objects.filter(pk__in=pks).values('pk', *fields))
+            now = timezone.now()
+            rows = {}
+            for pk, digest, html, excerpt in rendered:
+                if pk not in old:
+                    continue
+                values = {'content_html': html, 'content_hash': digest,
+                          'excerpt_html': excerpt,
+                          'updated_time': old[pk]['updated_time']}
+                # Only a different output counts as a modification.
+                if any(values[name] != old[pk][name] for name in fields
+                       if name not in ('content_hash', 'updated_time')):
+                    values['updated_time'] = now
+                    changed += 1
+                rows[pk] = values
+            bulk_update(model, rows, fields)
+            if model is Article:
+                search.index_articles(Article.objects.filter(pk__in=[
+                    pk for pk, values in rows.items()
+                    if values['updated_time'] == now]))
+            seen += len(rendered)
+            elapsed = time.time() - start
+            self.stdout.write(
+                '%s: %d/%d rendered, %d changed (%.1f rows/s)' % (
+                    name, seen, total, changed,
+                    seen / elapsed if elapsed else 0))
+
+        self.stdout.write(self.style.SUCCESS(
+            '%s: %d rendered, %d changed in %.2fs' % (
+                name, seen, changed, time.time() - start)))
+        return changed
@@ -0,0 +1,51 @@
+# coding: utf-8
+from django.conf import settings
+
+from . import cache, routers
+
+
+STICKY_COOKIE = 'blog_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaMiddleware(object):
+    """Route the reads of public views to the replicas, see
+    ``blog.routers``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.reset()
+        try:
+            response = self.get_response(request)
+            if routers.wrote() and request.method not in SAFE_METHODS:
+                response.set_cookie(
+                    STICKY_COOKIE, '1',
+                    max_age=getattr(settings, 'BLOG_REPLICA_STICKY_SECONDS',
+                                    10),
+                    httponly=True)
+            if response.streaming:
+                response.streaming_content = self.stream(
+                    response.streaming_content, routers.save())
+            return response
+        finally:
+            routers.reset()
+
+    def stream(self, content, state):
+        # Streamed content is generated after __call__ returned, keep
+        # routing its queries like those of the view until it ends.
+        routers.restore(state)
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            routers.reset()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (match is not None and match.namespace == 'blog' and
+                request.method in SAFE_METHODS and
+                STICKY_COOKIE not in request.COOKIES and
+                routers.replicas() and not cache.recently_invalidated()):
+            routers.use_replicas()
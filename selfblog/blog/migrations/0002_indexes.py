@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:04
+
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='article',
+            index_together=set([('slug', 'published_time'), ('status', 'published_time')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='page',
+            index_together=set([('status', 'rank', 'created_time')]),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:13
+
+
+import re
+import unicodedata
+from collections import Counter
+from html import unescape
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.html import strip_tags
+
+
+# The tokenizer of blog.search when the index was added.
+TITLE_WEIGHT = 3
+MAX_TERM_LENGTH = 64
+CJK = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TOKEN_RE = re.compile(u'[%s]+|[^\\W_%s]+' % (CJK, CJK), re.UNICODE)
+CJK_RE = re.compile(u'[%s]' % CJK, re.UNICODE)
+
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return unicodedata.normalize('NFC', ''.join(
+        c for c in text if not unicodedata.combining(c)))
+
+
+def tokenize(text):
+    terms = []
+    for token in TOKEN_RE.findall(fold(text)):
+        if CJK_RE.match(token) and len(token) > 1:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+def article_terms(title, content_html):
+    terms = Counter(tokenize(unescape(strip_tags(content_html))))
+    for term in tokenize(title):
+        terms[term] += TITLE_WEIGHT
+    return terms
+
+
+def index_articles(apps, schema_editor, batch_size=500):
+    Article = apps.get_model('blog', 'Article')
+    SearchDocument = apps.get_model('blog', 'SearchDocument')
+    SearchPosting = apps.get_model('blog', 'SearchPosting')
+    last_pk = 0
+    while True:
+        rows = list(Article.objects.filter(
+            status=0, pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'title', 'content_html')[:batch_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        documents, postings = [], []
+        for pk, title, content_html in rows:
+            terms = article_terms(title, content_html)
+            length = sum(terms.values())
+            documents.append(SearchDocument(article_id=pk, length=length))
+            postings.extend(
+                SearchPosting(term=term, document_id=pk,
+                              frequency=frequency, length=length)
+                for term, frequency in terms.items())
+        SearchDocument.objects.bulk_create(documents)
+        SearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='blog.Article')),
+                ('length', models.PositiveIntegerField(verbose_name='Length')),
+            ],
+            options={
+                'verbose_name': 'Search Documents',
+                'verbose_name_plural': 'Search Documents',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='Term')),
+                ('frequency', models.PositiveIntegerField(verbose_name='Frequency')),
+                ('length', models.PositiveIntegerField(verbose_name='Length')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='blog.SearchDocument')),
+            ],
+            options={
+                'verbose_name': 'Search Postings',
+                'verbose_name_plural': 'Search Postings',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchposting',
+            unique_together=set([('term', 'document')]),
+        ),
+        migrations.RunPython(index_articles, migrations.RunPython.noop),
+    ]
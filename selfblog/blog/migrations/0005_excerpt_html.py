@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:21
+
+
+import markdown2
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+# Excerpt rules of blog.rendering at the time.
+EXCERPT_SEPARATOR = '<!--more-->'
+EXCERPT_WORDS = 50
+
+
+def render_excerpt(content, html):
+    if EXCERPT_SEPARATOR in content:
+        return markdown2.markdown(content.split(EXCERPT_SEPARATOR, 1)[0],
+                                  extras=['fenced-code-blocks'])
+    return Truncator(html).words(EXCERPT_WORDS, html=True, truncate=' ...')
+
+
+def fill_excerpts(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    rows = Article.objects.order_by('pk').values_list(
+        'pk', 'content', 'content_html')
+    for pk, content, content_html in rows.iterator():
+        Article.objects.filter(pk=pk).update(
+            excerpt_html=render_excerpt(content, content_html))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='Html Excerpt'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
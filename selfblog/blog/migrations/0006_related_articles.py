@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:33
+
+
+import math
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Scoring of blog.related.rebuild, frozen here.
+RELATED_ARTICLES = 5
+RELATED_CATEGORY_WEIGHT = 0.5
+
+
+def fill_related(apps, schema_editor, batch_size=500):
+    Article = apps.get_model('blog', 'Article')
+    RelatedArticle = apps.get_model('blog', 'RelatedArticle')
+    published = Article.objects.filter(status=0)
+    categories = dict(published.values_list('pk', 'category_id'))
+    tags = defaultdict(list)
+    tagged = defaultdict(list)
+    for pk, tag in Article.tags.through.objects.filter(
+            article__status=0).values_list('article_id', 'tag_id'):
+        tags[pk].append(tag)
+        tagged[tag].append((pk, categories[pk]))
+    weights = dict((tag, 1 / math.log(2 + len(articles)))
+                   for tag, articles in tagged.items())
+    recent = defaultdict(list)
+    for pk, category in published.order_by('-published_time').values_list(
+            'pk', 'category_id'):
+        if len(recent[category]) <= RELATED_ARTICLES:
+            recent[category].append(pk)
+
+    rows = []
+    for pk, category in categories.items():
+        scores = defaultdict(float)
+        for tag in tags[pk]:
+            for other, other_category in tagged[tag]:
+                if other == pk:
+                    continue
+                if other not in scores and other_category == category:
+                    scores[other] += RELATED_CATEGORY_WEIGHT
+                scores[other] += weights[tag]
+        for other in recent[category]:
+            if other != pk and other not in scores:
+                scores[other] = RELATED_CATEGORY_WEIGHT
+        rows.extend(
+            RelatedArticle(article_id=pk, related_id=related, score=value)
+            for related, value in sorted(
+                scores.items(), key=lambda item: (-item[1], -item[0]))[
+                    :RELATED_ARTICLES])
+        if len(rows) >= batch_size:
+            RelatedArticle.objects.bulk_create(rows)
+            rows = []
+    RelatedArticle.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_excerpt_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedArticle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Score')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='blog.Article')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.Article')),
+            ],
+            options={
+                'verbose_name': 'Related Articles',
+                'verbose_name_plural': 'Related Articles',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedarticle',
+            unique_together=set([('article', 'related')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='relatedarticle',
+            index_together=set([('article', 'score')]),
+        ),
+        migrations.RunPython(fill_related, migrations.RunPython.noop),
+    ]
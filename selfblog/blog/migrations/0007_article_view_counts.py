@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:43
+
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_related_articles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleViewCount',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_count', serialize=False, to='blog.Article')),
+                ('views', models.PositiveIntegerField(db_index=True, default=0, verbose_name='Views')),
+            ],
+            options={
+                'verbose_name': 'Article View Counts',
+                'verbose_name_plural': 'Article View Counts',
+            },
+        ),
+    ]
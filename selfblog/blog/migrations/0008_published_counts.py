@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:45
+
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counts(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    Category = apps.get_model('blog', 'Category')
+    Tag = apps.get_model('blog', 'Tag')
+    published = Article.objects.filter(status=0).order_by()
+    for pk, count in published.values('category').annotate(
+            count=Count('pk')).values_list('category', 'count'):
+        Category.objects.filter(pk=pk).update(published_count=count)
+    for pk, count in published.values('tags').annotate(
+            count=Count('pk')).values_list('tags', 'count'):
+        if pk is not None:
+            Tag.objects.filter(pk=pk).update(published_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_article_view_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='published_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Published Articles'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='published_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Published Articles'),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 19:49
+
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_archive_months(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    ArchiveMonth = apps.get_model('blog', 'ArchiveMonth')
+    counts = Counter()
+    for published_time in Article.objects.filter(status=0).values_list(
+            'published_time', flat=True).iterator():
+        published_time = published_time.astimezone(timezone.utc)
+        counts[published_time.year, published_time.month] += 1
+    ArchiveMonth.objects.bulk_create(
+        [ArchiveMonth(year=year, month=month, count=count)
+         for (year, month), count in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_published_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Year')),
+                ('month', models.PositiveSmallIntegerField(verbose_name='Month')),
+                ('count', models.PositiveIntegerField(verbose_name='Published Articles')),
+            ],
+            options={
+                'verbose_name': 'Archive Months',
+                'verbose_name_plural': 'Archive Months',
+                'ordering': ['-year', '-month'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivemonth',
+            unique_together=set([('year', 'month')]),
+        ),
+        migrations.RunPython(fill_archive_months, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,21 @@
 # coding: utf-8
 
 
-import markdown2
+import re
+from collections import Counter
+from datetime import datetime
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Lower
+from django.utils.timezone import utc
 
+from .bulk import bulk_update
+from .rendering import render_content
+
+
+# Tag URLs take word characters and hyphens.
+TAG_SLUG_RE = re.compile(r'\W+', re.UNICODE)
 
 STATUS = {
     0: 'Publish',
@@ -13,14 +24,41 @@ STATUS = {
 }
 
 
+class PublishedCountQuerySet(models.QuerySet):
+    # Name of the relation to the articles.
+    articles = None
+
+    def recount(self):
+        """Store the number of published articles of the selected rows,
+        return how many rows changed."""
+        counts = dict(self.filter(**{self.articles + '__status': 0}).order_by(
+            ).values('pk').annotate(count=Count(self.articles)).values_list(
+                'pk', 'count'))
+        rows = dict(
+            (pk, {'published_count': counts.get(pk, 0)}) for pk, count in
+            self.order_by().values_list('pk', 'published_count')
+            if counts.get(pk, 0) != count)
+        bulk_update(self.model, rows, ['published_count'])
+        return len(rows)
+
+
+class CategoryQuerySet(PublishedCountQuerySet):
+    articles = 'article'
+
+
 class Category(models.Model):
     name = models.CharField(max_length=40, verbose_name='Name', unique=True)
     slug = models.SlugField(max_length=40, verbose_name='Slug')
+    # Kept up to date by blog.signals, manage.py recount repairs it.
+    published_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Published Articles')
 
     created_time = models.DateTimeField('Created Date', auto_now_add=True,
                                         editable=True)
     updated_time = models.DateTimeField('Updated Date', auto_now=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     def __unicode__(self):
         return self.name
 
@@ -29,13 +67,86 @@ class Category(models.Model):
         verbose_name_plural = verbose_name = "Categories"
 
 
+class TagQuerySet(PublishedCountQuerySet):
+    articles = 'articles'
+
+    def named(self, names):
+        """The tags called ``names``, given in lower case, whatever the
+        case of the tags."""
+        return self.annotate(lower_name=Lower('name')).filter(
+            lower_name__in=names)
+
+    def resolve(self, names):
+        """Return the tags called ``names``, creating the missing ones.
+
+        Names match existing tags whatever their case. Costs one query when
+        all exist and six otherwise.
+        """
+        names = sorted(set(name.strip().lower() for name in names
+                           if name.strip()))
+        if not names:
+            return []
+        tags = dict((tag.name.lower(), tag) for tag in self.named(names))
+        missing = [name for name in names if name not in tags]
+        if missing:
+            self._create(missing)
+            # bulk_create doesn't set primary keys on SQLite and MySQL.
+            tags.update((tag.name.lower(), tag)
+                        for tag in self.named(missing))
+        return [tags[name] for name in names]
+
+    def _slugs(self, names):
+        """Unique slugs for new tags called ``names``, like "machine-learning"
+        for "machine learning"."""
+        length = Tag._meta.get_field('slug').max_length
+        slugs = dict((name, TAG_SLUG_RE.sub('-', name).strip('-')[:length] or
+                      'tag') for name in names)
+        taken = set(self.filter(slug__in=set(slugs.values())).values_list(
+            'slug', flat=True))
+        if taken:
+            # Rare, read the numbered slugs of the clashing ones.
+            query = Q()
+            for slug in taken:
+                query |= Q(slug__startswith=slug + '-')
+            taken.update(self.filter(query).values_list('slug', flat=True))
+        for name in names:
+            slug, number = slugs[name], 1
+            while slug in taken:
+                number += 1
+                suffix = '-%d' % number
+                slug = slugs[name][:length - len(suffix)] + suffix
+            taken.add(slug)
+            slugs[name] = slug
+        return slugs
+
+    def _create(self, names):
+        slugs = self._slugs(names)
+        try:
+            with transaction.atomic():
+                self.bulk_create([Tag(name=name, slug=slugs[name])
+                                  for name in names])
+        except IntegrityError:
+            # Another request created some of them, create the others.
+            for name in names:
+                try:
+                    with transaction.atomic():
+                        self.create(name=name, slug=slugs[name])
+                except IntegrityError:
+                    pass
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=40, verbose_name='Name', unique=True)
     slug = models.SlugField(max_length=40, verbose_name='Slug')
+    # Kept up to date by blog.signals, manage.py recount repairs it.
+    published_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Published Articles')
 
     created_time = models.DateTimeField('Created Date', auto_now_add=True)
     updated_time = models.DateTimeField('Updated Date', auto_now=True)
 
+    objects = TagQuerySet.as_manager()
+
     def __unicode__(self):
         return self.name
 
@@ -44,6 +155,42 @@ class Tag(models.Model):
         verbose_name_plural = verbose_name = "Tags"
 
 
+class ArticleQuerySet(models.QuerySet):
+    def published(self):
+        return self.filter(status=0)
+
+    def for_listing(self):
+        # Listing pages show the category and tags of every article, fetch
+        # them up front instead of one query per row in the template. They
+        # only show the excerpt, never the full content.
+        return self.select_related('category').prefetch_related(
+            'tags').defer('content', 'content_html')
+
+    def in_month(self, year, month):
+        """The articles published in a month, the UTC one used in their
+        URLs."""
+        start = datetime(year, month, 1, tzinfo=utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=utc)
+        return self.filter(published_time__gte=start, published_time__lt=end)
+
+    def in_year(self, year):
+        return self.filter(
+            published_time__gte=datetime(year, 1, 1, tzinfo=utc),
+            published_time__lt=datetime(year + 1, 1, 1, tzinfo=utc))
+
+    def for_detail(self, year, month, slug):
+        """The articles at ``/post/<year>/<month>/<slug>``, with everything
+        the detail page shows."""
+        return self.in_month(year, month).filter(slug=slug).select_related(
+            'category').prefetch_related('tags').defer(
+                'content', 'excerpt_html')
+
+
+class PublishedManager(models.Manager.from_queryset(ArticleQuerySet)):
+    def get_queryset(self):
+        return super(PublishedManager, self).get_queryset().published()
+
+
 class Article(models.Model):
     category = models.ForeignKey(Category, verbose_name='Category')
 
@@ -51,6 +198,10 @@ class Article(models.Model):
     slug = models.SlugField(max_length=100, verbose_name='Slug')
     content = models.TextField(verbose_name='Content')
     content_html = models.TextField(verbose_name='Html Content', editable=False)
+    content_hash = models.CharField(max_length=40, verbose_name='Content Hash',
+                                    editable=False, blank=True)
+    excerpt_html = models.TextField(verbose_name='Html Excerpt',
+                                    editable=False, blank=True)
     tags = models.ManyToManyField(Tag, verbose_name='Tags',
                                   related_name='articles', blank=True,
                                   help_text='Split with comma')
@@ -61,6 +212,9 @@ class Article(models.Model):
                                           editable=True)
     updated_time = models.DateTimeField('Updated Date', auto_now=True)
 
+    objects = ArticleQuerySet.as_manager()
+    published = PublishedManager()
+
     def __unicode__(self):
         return self.title
 
@@ -73,13 +227,17 @@ class Article(models.Model):
         return self.published_time.month
 
     def save(self, *args, **kwargs):
-        self.content_html = markdown2.markdown(
-            self.content,
-            extras=['fenced-code-blocks'])
+        render_content(self)
         super(Article, self).save(*args, **kwargs)
 
     class Meta:
         ordering = ['-published_time']
+        # Public queries filter on status and order by published time, the
+        # detail view looks an article up by slug within a month.
+        index_together = [
+            ('status', 'published_time'),
+            ('slug', 'published_time'),
+        ]
         verbose_name_plural = verbose_name = 'Articles'
 
 
@@ -89,6 +247,8 @@ class Page(models.Model):
     content = models.TextField(verbose_name='Content')
     content_html = models.TextField(verbose_name='HTML Content',
                                     editable=False)
+    content_hash = models.CharField(max_length=40, verbose_name='Content Hash',
+                                    editable=False, blank=True)
 
     rank = models.IntegerField(default=1, verbose_name='Rank',
                                help_text='Display order')
@@ -102,11 +262,97 @@ class Page(models.Model):
         return self.title
 
     def save(self, *args, **kwargs):
-        self.content_html = markdown2.markdown(
-            self.content,
-            extras=['fenced-code-blocks'])
+        render_content(self)
         super(Page, self).save(*args, **kwargs)
 
     class Meta:
         ordering = ['-rank', '-created_time']
+        index_together = [
+            ('status', 'rank', 'created_time'),
+        ]
         verbose_name_plural = verbose_name = "Pages"
+
+
+class SearchDocument(models.Model):
+    """An article in the search index, see blog/search.py."""
+    article = models.OneToOneField(Article, primary_key=True,
+                                   related_name='search_document')
+    length = models.PositiveIntegerField(verbose_name='Length')
+
+    class Meta:
+        verbose_name_plural = verbose_name = 'Search Documents'
+
+
+class SearchPosting(models.Model):
+    """How often a term occurs in an indexed article."""
+    term = models.CharField(max_length=64, verbose_name='Term')
+    document = models.ForeignKey(SearchDocument, related_name='postings')
+    frequency = models.PositiveIntegerField(verbose_name='Frequency')
+    # Copied from the document, ranking then needs no join.
+    length = models.PositiveIntegerField(verbose_name='Length')
+
+    class Meta:
+        unique_together = [('term', 'document')]
+        verbose_name_plural = verbose_name = 'Search Postings'
+
+
+class RelatedArticle(models.Model):
+    """One of the articles shown under an article, see blog/related.py."""
+    article = models.ForeignKey(Article, related_name='related_entries')
+    related = models.ForeignKey(Article, related_name='+')
+    score = models.FloatField(verbose_name='Score')
+
+    class Meta:
+        unique_together = [('article', 'related')]
+        index_together = [('article', 'score')]
+        verbose_name_plural = verbose_name = 'Related Articles'
+
+
+class ArticleViewCount(models.Model):
+    """How often an article was read, see blog/counters.py."""
+    article = models.OneToOneField(Article, primary_key=True,
+                                   related_name='view_count')
+    views = models.PositiveIntegerField(default=0, db_index=True,
+                                        verbose_name='Views')
+
+    class Meta:
+        verbose_name_plural = verbose_name = 'Article View Counts'
+
+
+class ArchiveMonthQuerySet(models.QuerySet):
+    def recount(self, months):
+        """Recount the published articles of ``months``, ``(year, month)``
+        pairs."""
+        for year, month in set(months):
+            count = Article.published.in_month(year, month).count()
+            if count:
+                self.update_or_create(year=year, month=month,
+                                      defaults={'count': count})
+            else:
+                self.filter(year=year, month=month).delete()
+
+    def rebuild(self):
+        """Recount every month, return the number of months."""
+        counts = Counter(
+            (published_time.year, published_time.month) for published_time in
+            Article.published.order_by().values_list(
+                'published_time', flat=True).iterator())
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([ArchiveMonth(year=year, month=month, count=count)
+                              for (year, month), count in counts.items()])
+        return len(counts)
+
+
+class ArchiveMonth(models.Model):
+    """How many articles were published in a month, the archives index."""
+    year = models.PositiveSmallIntegerField(verbose_name='Year')
+    month = models.PositiveSmallIntegerField(verbose_name='Month')
+    count = models.PositiveIntegerField(verbose_name='Published Articles')
+
+    objects = ArchiveMonthQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-year', '-month']
+        unique_together = [('year', 'month')]
+        verbose_name_plural = verbose_name = 'Archive Months'
@@ -0,0 +1,141 @@
+# coding: utf-8
+"""Keyset pagination for article listings.
+
+Django's ``Paginator`` needs a ``COUNT(*)`` and an ``OFFSET`` scan which gets
+slower the deeper a page is. ``CursorPaginator`` instead remembers the
+``(published_time, id)`` of the first/last article of a page in an opaque
+token and asks the database for the rows right before or after it.
+``iterate_newest_first`` walks a whole queryset the same way.
+"""
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def make_cursor(published_time, pk):
+    value = '%s|%d' % (published_time.isoformat(), pk)
+    return force_text(urlsafe_base64_encode(force_bytes(value)))
+
+
+def encode_cursor(article):
+    return make_cursor(article.published_time, article.pk)
+
+
+def decode_cursor(token):
+    try:
+        value = force_text(urlsafe_base64_decode(token))
+        published_time, pk = value.rsplit('|', 1)
+        published_time = parse_datetime(published_time)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if published_time is None:
+        raise InvalidCursor(token)
+    return published_time, pk
+
+
+class CursorPage(object):
+    """A page of articles, quacks like ``django.core.paginator.Page``."""
+
+    number = None
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %d items>' % len(self)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """Paginate a queryset newest first on ``(published_time, id)``.
+
+    ``cursor`` makes the token of an item, pass one built on ``make_cursor``
+    to paginate e.g. a values queryset.
+    """
+
+    def __init__(self, object_list, per_page, cursor=encode_cursor):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.cursor = cursor
+
+    def page(self, after=None, before=None):
+        """Return the page older than ``after`` or newer than ``before``.
+
+        Raise ``InvalidCursor`` if the given token can not be decoded.
+        """
+        limit = self.per_page + 1
+        if before:
+            published_time, pk = decode_cursor(before)
+            items = list(self.object_list.filter(
+                Q(published_time__gt=published_time) |
+                Q(published_time=published_time, pk__gt=pk)).order_by(
+                    'published_time', 'pk')[:limit])
+            has_previous = len(items) > self.per_page
+            items = items[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.object_list
+            if after:
+                published_time, pk = decode_cursor(after)
+                queryset = queryset.filter(
+                    Q(published_time__lt=published_time) |
+                    Q(published_time=published_time, pk__lt=pk))
+            items = list(queryset.order_by(
+                '-published_time', '-pk')[:limit])
+            has_next = len(items) > self.per_page
+            items = items[:self.per_page]
+            has_previous = bool(after)
+
+        next_cursor = previous_cursor = None
+        if items:
+            if has_next:
+                next_cursor = self.cursor(items[-1])
+            if has_previous:
+                previous_cursor = self.cursor(items[0])
+        return CursorPage(items, next_cursor, previous_cursor)
+
+
+def iterate_newest_first(queryset, fields, size):
+    """Yield ``(published_time, id, *fields)`` of every row of ``queryset``,
+    newest first, fetching ``size`` rows per query.
+
+    No query holds more than ``size`` rows, unlike a plain ``iterator()``
+    which most MySQL and SQLite drivers buffer completely.
+    """
+    queryset = queryset.order_by('-published_time', '-pk').values_list(
+        'published_time', 'pk', *fields)
+    chunk = list(queryset[:size].iterator())
+    while chunk:
+        for row in chunk:
+            yield row
+        if len(chunk) < size:
+            return
+        published_time, pk = chunk[-1][:2]
+        chunk = list(queryset.filter(
+            Q(published_time__lt=published_time) |
+            Q(published_time=published_time, pk__lt=pk))[:size].iterator())
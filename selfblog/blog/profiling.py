@@ -0,0 +1,164 @@
+# coding: utf-8
+"""Per-request profiling of the time spent in SQL, markdown and templates.
+
+``ProfilingMiddleware`` measures a sample of the requests
+(``BLOG_PROFILING_SAMPLE_RATE``), sends the timings back in a
+``Server-Timing`` header and keeps the last ``PROFILE_WINDOW`` samples of
+every URL name in memory for the admin page at ``/admin/profiling/``.
+Unsampled requests only cost a call to ``random.random()``.
+
+SQL is measured through Django's debug cursor, which is only switched on
+for sampled requests.
+"""
+import random
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from .constants import PROFILE_WINDOW
+
+
+# Upper bounds in milliseconds of the histogram buckets.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_local = threading.local()
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+class Profile(object):
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def add(self, metric, seconds):
+        self.timings[metric] = self.timings.get(metric, 0) + seconds
+
+
+@contextmanager
+def timed(metric):
+    """Add the time spent in the block to ``metric`` of the profiled
+    request, if any."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile.add(metric, time.time() - start)
+
+
+class RouteStats(object):
+    """The last ``size`` samples of one URL name."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+
+    def add(self, sample):
+        # deque.append is atomic, no lock needed.
+        self.samples.append(sample)
+        self.requests += 1
+
+    def summary(self):
+        samples = list(self.samples)
+        totals = sorted(sample['total'] for sample in samples)
+        count = len(samples)
+
+        def percentile(percent):
+            return totals[max(0, int(round(percent / 100.0 * count)) - 1)]
+
+        def mean(metric):
+            return sum(sample.get(metric, 0) for sample in samples) / count
+
+        histogram = [0] * (len(BUCKETS) + 1)
+        for total in totals:
+            index = 0
+            while index < len(BUCKETS) and total > BUCKETS[index]:
+                index += 1
+            histogram[index] += 1
+        return {
+            'requests': self.requests,
+            'samples': count,
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'p99': percentile(99),
+            'queries': mean('queries'),
+            'db': mean('db'),
+            'template': mean('template'),
+            'markdown': mean('markdown'),
+            'histogram': histogram,
+        }
+
+
+def record(name, sample):
+    stats = _routes.get(name)
+    if stats is None:
+        with _routes_lock:
+            stats = _routes.setdefault(name, RouteStats(PROFILE_WINDOW))
+    stats.add(sample)
+
+
+def summaries():
+    """Return ``[(url name, summary)]`` sorted by name."""
+    return [(name, _routes[name].summary()) for name in sorted(_routes)]
+
+
+def reset():
+    with _routes_lock:
+        _routes.clear()
+
+
+class ProfilingMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'BLOG_PROFILING_SAMPLE_RATE', 0)
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        profile = _local.profile = Profile()
+        databases = []
+        for connection in connections.all():
+            databases.append((connection, connection.force_debug_cursor,
+                              len(connection.queries_log)))
+            connection.force_debug_cursor = True
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.time() - start
+            _local.profile = None
+            queries = []
+            for connection, force_debug_cursor, seen in databases:
+                connection.force_debug_cursor = force_debug_cursor
+                queries.extend(list(connection.queries_log)[seen:])
+
+        timings = profile.timings
+        timings['db'] = sum(float(query['time']) for query in queries)
+        timings['total'] = total
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f' % (metric, seconds * 1000)
+            for metric, seconds in timings.items())
+
+        match = request.resolver_match
+        if match is not None:
+            sample = dict((metric, seconds * 1000)
+                          for metric, seconds in timings.items())
+            sample['queries'] = len(queries)
+            record(match.view_name, sample)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            start = time.time()
+            response.add_post_render_callback(
+                lambda r: profile.add('template', time.time() - start))
+        return response
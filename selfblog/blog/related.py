@@ -0,0 +1,222 @@
+# coding: utf-8
+"""Related posts, precomputed from shared tags and categories.
+
+Every published article keeps its ``RELATED_ARTICLES`` best matches in
+``RelatedArticle``, so the detail page reads them with one indexed query.
+Two articles score the sum of ``tag_weight`` over their shared tags, plus
+``RELATED_CATEGORY_WEIGHT`` if they are in the same category. The most
+recent articles of the category fill in when there are too few shared tags.
+
+Writes rescore the article and the lists it may enter or leave (see
+``refresh``). Tag weights depend on how many articles use a tag, lists not
+touched by a write keep their old weights until ``manage.py
+rebuild_related`` recomputes everything.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from . import cache, sitemaps
+from .constants import (RELATED_ARTICLES, RELATED_CATEGORY_WEIGHT,
+                        RELATED_CANDIDATES)
+from .models import Article, RelatedArticle
+
+
+Tagged = Article.tags.through
+
+
+def tag_weight(count):
+    """Weight of a tag used by ``count`` published articles."""
+    return 1 / math.log(2 + count)
+
+
+def score(pk, category, tags, weights, tagged, recent):
+    """Return ``{article pk: score}`` of the articles related to ``pk``.
+
+    ``tagged`` maps tags to ``(article pk, category)`` of their published
+    articles and ``recent`` lists the latest articles of ``category``.
+    """
+    scores = defaultdict(float)
+    for tag in tags:
+        for other, other_category in tagged.get(tag, ()):
+            if other == pk:
+                continue
+            if other not in scores and other_category == category:
+                scores[other] += RELATED_CATEGORY_WEIGHT
+            scores[other] += weights[tag]
+    for other in recent:
+        if other != pk and other not in scores:
+            scores[other] = RELATED_CATEGORY_WEIGHT
+    return scores
+
+
+def best(scores, count=RELATED_ARTICLES):
+    """The ``count`` best ``(pk, score)``, newer articles win ties."""
+    return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[
+        :count]
+
+
+def article_scores(pk):
+    """Score the candidates of article ``pk`` from the database."""
+    category = Article.published.filter(pk=pk).values_list(
+        'category_id', flat=True).first()
+    if category is None:
+        return {}
+    tags = list(Tagged.objects.filter(article_id=pk).values_list(
+        'tag_id', flat=True))
+    tagged = defaultdict(list)
+    for other, tag, other_category in Tagged.objects.filter(
+            tag_id__in=tags, article__status=0).values_list(
+                'article_id', 'tag_id', 'article__category_id'):
+        tagged[tag].append((other, other_category))
+    weights = dict((tag, tag_weight(len(tagged[tag]))) for tag in tags)
+    recent = Article.published.filter(category_id=category).order_by(
+        '-published_time').values_list('pk', flat=True)[
+            :RELATED_ARTICLES + 1]
+    return score(pk, category, tags, weights, tagged, list(recent))
+
+
+def replace(pk, rows):
+    """Store ``rows`` as the related articles of ``pk``, return whether the
+    list changed."""
+    old = list(RelatedArticle.objects.filter(article_id=pk).order_by(
+        '-score', '-related_id').values_list('related_id', 'score'))
+    if [r for r, s in old] == [r for r, s in rows]:
+        return False
+    with transaction.atomic():
+        RelatedArticle.objects.filter(article_id=pk).delete()
+        RelatedArticle.objects.bulk_create(
+            [RelatedArticle(article_id=pk, related_id=related, score=value)
+             for related, value in rows])
+    return True
+
+
+def refresh(pks):
+    """Rescore the articles ``pks`` after a write, and update the lists
+    they may enter or leave.
+
+    Scores are symmetric, so the scores of ``pk`` tell how it ranks in the
+    lists of its candidates. Only a list ``pk`` drops out of is rescored.
+    """
+    pks = set(pks)
+    changed = set()
+    rescore = set()
+    for pk in pks:
+        scores = article_scores(pk)
+        if replace(pk, best(scores)):
+            changed.add(pk)
+
+        holding = set()
+        for other, old in RelatedArticle.objects.filter(
+                related_id=pk).values_list('article_id', 'score'):
+            holding.add(other)
+            value = scores.get(other)
+            if value is None or value < old:
+                rescore.add(other)
+            elif value != old:
+                RelatedArticle.objects.filter(
+                    article_id=other, related_id=pk).update(score=value)
+                changed.add(other)
+
+        candidates = dict(
+            (other, value) for other, value in best(scores,
+                                                    RELATED_CANDIDATES)
+            if other not in holding and other not in pks)
+        lists = dict(
+            (other, (count, lowest)) for other, count, lowest in
+            RelatedArticle.objects.filter(
+                article_id__in=list(candidates)).values(
+                    'article_id').annotate(
+                        count=Count('pk'), lowest=Min('score')).values_list(
+                            'article_id', 'count', 'lowest'))
+        for other, value in candidates.items():
+            count, lowest = lists.get(other, (0, None))
+            if count < RELATED_ARTICLES or value > lowest:
+                enter(other, pk, value, count)
+                changed.add(other)
+
+    for pk in rescore - pks:
+        if replace(pk, best(article_scores(pk))):
+            changed.add(pk)
+    show_changes(changed)
+
+
+def enter(pk, related, value, count):
+    """Add ``related`` to the ``count`` related articles of ``pk``, pushing
+    the last one out of a full list."""
+    with transaction.atomic():
+        RelatedArticle.objects.create(article_id=pk, related_id=related,
+                                      score=value)
+        if count >= RELATED_ARTICLES:
+            RelatedArticle.objects.filter(pk__in=list(
+                RelatedArticle.objects.filter(article_id=pk).order_by(
+                    'score', 'related_id').values_list('pk', flat=True)[
+                        :count + 1 - RELATED_ARTICLES])).delete()
+
+
+def show_changes(pks):
+    """Refresh the cached pages and validators of articles whose related
+    posts changed."""
+    if not pks:
+        return
+    pks = list(pks)
+    articles = Article.objects.filter(pk__in=pks)
+    cache.invalidate(*[cache.article_scope(slug) for slug in
+                       articles.values_list('slug', flat=True)] +
+                     list(sitemaps.chunk_scopes(Article, pks)))
+    articles.update(updated_time=timezone.now())
+
+
+def rebuild(batch_size=500):
+    """Recompute the related articles of every published article in
+    memory, return the number of articles."""
+    categories = dict(Article.published.values_list('pk', 'category_id'))
+    tags = defaultdict(list)
+    tagged = defaultdict(list)
+    for pk, tag in Tagged.objects.filter(
+            article__status=0).values_list('article_id', 'tag_id'):
+        tags[pk].append(tag)
+        tagged[tag].append((pk, categories[pk]))
+    weights = dict((tag, tag_weight(len(articles)))
+                   for tag, articles in tagged.items())
+    recent = defaultdict(list)
+    for pk, category in Article.published.order_by(
+            '-published_time').values_list('pk', 'category_id'):
+        if len(recent[category]) <= RELATED_ARTICLES:
+            recent[category].append(pk)
+
+    rows = []
+    with transaction.atomic():
+        RelatedArticle.objects.all().delete()
+        for pk, category in categories.items():
+            scores = score(pk, category, tags[pk], weights, tagged,
+                           recent[category])
+            rows.extend(RelatedArticle(article_id=pk, related_id=related,
+                                       score=value)
+                        for related, value in best(scores))
+            if len(rows) >= batch_size:
+                RelatedArticle.objects.bulk_create(rows)
+                rows = []
+        RelatedArticle.objects.bulk_create(rows)
+    cache.invalidate_all()
+    return len(categories)
+
+
+def related_articles(article):
+    """The published related articles of ``article``.
+
+    Kept on the article, so hot articles (see ``cache.published_article``)
+    don't query them again.
+    """
+    if not hasattr(article, '_related_articles'):
+        entries = RelatedArticle.objects.filter(
+            article=article, related__status=0).select_related(
+                'related').only(
+                    'related__title', 'related__slug',
+                    'related__published_time').order_by(
+                        '-score', '-related_id')
+        article._related_articles = [entry.related for entry in entries]
+    return article._related_articles
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""Markdown rendering for articles and pages.
+
+The rendered HTML is stored next to a hash of the source and the renderer
+configuration, so saving a row whose content did not change skips
+markdown2, and so does rendering a source that was rendered recently.
+
+Pygments output of fenced code blocks is cached separately, because the
+same snippets recur across posts and highlighting them dominates rendering
+of code-heavy ones.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import markdown2
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+from django.utils.text import Truncator
+
+from . import profiling
+from .constants import (MARKDOWN_EXTRAS, RENDER_MEMO_SIZE, EXCERPT_SEPARATOR,
+                        EXCERPT_WORDS, HIGHLIGHT_CACHE_SIZE,
+                        HIGHLIGHT_CACHE_TIMEOUT)
+
+
+# Anything that changes the output for the same source goes in here.
+RENDERER_SIGNATURE = 'markdown2-%s|%s|excerpt-%s-%d' % (
+    markdown2.__version__, ','.join(sorted(MARKDOWN_EXTRAS)),
+    EXCERPT_SEPARATOR, EXCERPT_WORDS)
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+class HighlightCache(object):
+    """LRU of highlighted code blocks keyed by lexer, code and formatter
+    options.
+
+    With ``BLOG_PERSISTENT_HIGHLIGHT_CACHE`` the blocks are also stored in
+    the default Django cache, which outlives the process and is shared by
+    the ``rerender_content`` workers if the backend is.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(lexer, code, options):
+        import pygments
+        lexer_class = type(lexer)
+        signature = repr((pygments.__version__, lexer_class.__module__,
+                          lexer_class.__name__, sorted(lexer.options.items()),
+                          sorted(options.items())))
+        return hashlib.sha1(force_bytes(signature + '\n' + code)).hexdigest()
+
+    def get(self, key, highlight):
+        """Return the block cached under ``key`` or store ``highlight()``."""
+        persistent = getattr(settings, 'BLOG_PERSISTENT_HIGHLIGHT_CACHE',
+                             False)
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return self._blocks[key]
+
+        html = cache.get('blog:highlight:' + key) if persistent else None
+        if html is None:
+            html = highlight()
+            if persistent:
+                cache.set('blog:highlight:' + key, html,
+                          HIGHLIGHT_CACHE_TIMEOUT)
+            hit = False
+        else:
+            hit = True
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._blocks[key] = html
+            while len(self._blocks) > self.size:
+                self._blocks.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {'pid': os.getpid(), 'hits': self.hits,
+                    'misses': self.misses, 'size': len(self._blocks)}
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.hits = self.misses = 0
+
+
+highlight_cache = HighlightCache(HIGHLIGHT_CACHE_SIZE)
+
+
+class Markdown(markdown2.Markdown):
+    """markdown2 with code blocks highlighted through ``highlight_cache``."""
+
+    def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
+        parent = super(Markdown, self)._color_with_pygments
+        return highlight_cache.get(
+            highlight_cache.key(lexer, codeblock, formatter_opts),
+            lambda: parent(codeblock, lexer, **formatter_opts))
+
+
+def content_hash(content):
+    return hashlib.sha1(
+        force_bytes(RENDERER_SIGNATURE + '\n' + content)).hexdigest()
+
+
+def render_markdown(content, digest=None):
+    """Render ``content`` to HTML, reusing recent results for the same hash."""
+    if digest is None:
+        digest = content_hash(content)
+    with _memo_lock:
+        if digest in _memo:
+            _memo.move_to_end(digest)
+            return _memo[digest]
+
+    with profiling.timed('markdown'):
+        html = Markdown(extras=MARKDOWN_EXTRAS).convert(content)
+
+    with _memo_lock:
+        _memo[digest] = html
+        while len(_memo) > RENDER_MEMO_SIZE:
+            _memo.popitem(last=False)
+    return html
+
+
+def render_excerpt(content, html):
+    """Return the HTML shown for an article in listings and the feed."""
+    if EXCERPT_SEPARATOR in content:
+        return render_markdown(content.split(EXCERPT_SEPARATOR, 1)[0])
+    return Truncator(html).words(EXCERPT_WORDS, html=True, truncate=' ...')
+
+
+def render_content(obj, force=False):
+    """Fill ``content_html`` of an article or page if its source changed,
+    and ``excerpt_html`` for articles.
+
+    Return True when the HTML was rendered.
+    """
+    digest = content_hash(obj.content)
+    if not force and digest == obj.content_hash and obj.content_html:
+        return False
+    obj.content_html = render_markdown(obj.content, digest)
+    obj.content_hash = digest
+    if hasattr(obj, 'excerpt_html'):
+        obj.excerpt_html = render_excerpt(obj.content, obj.content_html)
+    return True
+
+
+def render_rows(rows):
+    """Render ``(pk, content)`` pairs to ``(pk, content_hash, html,
+    excerpt_html)``.
+
+    Runs in worker processes of ``manage.py rerender_content``.
+    """
+    result = []
+    for pk, content in rows:
+        digest = content_hash(content)
+        html = render_markdown(content, digest)
+        result.append((pk, digest, html, render_excerpt(content, html)))
+    return result
+
+
+def render_rows_with_stats(rows):
+    """Return ``render_rows(rows)`` and the highlight cache statistics of
+    the process that rendered them."""
+    return render_rows(rows), highlight_cache.stats()
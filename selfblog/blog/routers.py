@@ -0,0 +1,73 @@
+# coding: utf-8
+"""Send the reads of public views to read replicas.
+
+Only requests handled by a view of the ``blog`` namespace with a safe
+method read from ``settings.BLOG_READ_REPLICAS`` (see
+``blog.middleware.ReplicaMiddleware``). Everything else, the admin,
+management commands and every write, uses ``default``.
+
+Replicas lag behind the primary, so a client which just wrote something
+keeps reading from the primary for ``BLOG_REPLICA_STICKY_SECONDS``, and so
+does the rest of a request once it wrote anything. Every client reads from
+the primary for as long after a write invalidated cached pages, otherwise
+a replica which didn't get the write yet would fill the cache with the old
+content under the new versions.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+
+PRIMARY = 'default'
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'BLOG_READ_REPLICAS', [])
+
+
+def reset():
+    """Send the reads of the current thread to the primary again."""
+    _state.replicas = False
+    _state.wrote = False
+
+
+def use_replicas():
+    """Let the reads of the current thread go to the replicas until it
+    writes or ``reset`` is called."""
+    if not wrote():
+        _state.replicas = True
+
+
+def wrote():
+    """Whether the current thread wrote since ``reset``."""
+    return getattr(_state, 'wrote', False)
+
+
+def save():
+    """The routing state of the current thread, for ``restore``."""
+    return getattr(_state, 'replicas', False), wrote()
+
+
+def restore(state):
+    _state.replicas, _state.wrote = state
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if aliases and getattr(_state, 'replicas', False):
+            return random.choice(aliases)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request.
+        _state.replicas = False
+        _state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
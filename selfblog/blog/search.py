@@ -0,0 +1,227 @@
+# coding: utf-8
+"""Full-text search over published articles.
+
+Titles and the text of ``content_html`` are split into terms and stored as
+an inverted index in two plain tables (``SearchDocument`` and
+``SearchPosting``), so it runs the same on SQLite and MySQL. Results are
+ranked with BM25. CJK text has no spaces between words, so it is indexed as
+overlapping character bigrams.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from html import unescape
+
+from django.db import transaction
+from django.db.models import (Avg, Case, Count, F, FloatField, Func, Q,
+                              Sum, Value, When)
+from django.utils.encoding import force_bytes, force_text
+from django.utils.html import escape, strip_tags
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+
+from .models import Article, SearchDocument, SearchPosting
+
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# A term in the title counts as often as this many in the content.
+TITLE_WEIGHT = 3
+MAX_TERM_LENGTH = 64
+# Decimals of the scores compared by the cursors.
+SCORE_DIGITS = 9
+SNIPPET_LENGTH = 240
+
+CJK = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TOKEN_RE = re.compile(u'[%s]+|[^\\W_%s]+' % (CJK, CJK), re.UNICODE)
+CJK_RE = re.compile(u'[%s]' % CJK, re.UNICODE)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def fold(text):
+    """Lower case ``text`` and strip its accents.
+
+    The case and accent insensitive collations of MySQL compare "resume"
+    and "r\u00e9sum\u00e9" as equal, they must be one term.
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return unicodedata.normalize('NFC', ''.join(
+        c for c in text if not unicodedata.combining(c)))
+
+
+def tokenize(text):
+    """Split text into folded terms."""
+    terms = []
+    for token in TOKEN_RE.findall(fold(text)):
+        if CJK_RE.match(token) and len(token) > 1:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+def html_text(html):
+    return unescape(strip_tags(html))
+
+
+def article_terms(title, content_html):
+    terms = Counter(tokenize(html_text(content_html)))
+    for term in tokenize(title):
+        terms[term] += TITLE_WEIGHT
+    return terms
+
+
+def _postings(pk, terms):
+    length = sum(terms.values())
+    return (SearchDocument(article_id=pk, length=length),
+            [SearchPosting(term=term, document_id=pk, frequency=frequency,
+                           length=length)
+             for term, frequency in terms.items()])
+
+
+def index_articles(queryset, batch_size=500):
+    """(Re)index the published articles of ``queryset``, drop the others.
+
+    Return the number of indexed articles.
+    """
+    indexed = 0
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by(
+            'pk').values_list('pk', 'status', 'title', 'content_html')[
+                :batch_size])
+        if not rows:
+            return indexed
+        last_pk = rows[-1][0]
+        documents, postings = [], []
+        for pk, status, title, content_html in rows:
+            if status == 0:
+                document, document_postings = _postings(
+                    pk, article_terms(title, content_html))
+                documents.append(document)
+                postings.extend(document_postings)
+        with transaction.atomic():
+            SearchDocument.objects.filter(
+                pk__in=[row[0] for row in rows]).delete()
+            SearchDocument.objects.bulk_create(documents)
+            SearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+        indexed += len(documents)
+
+
+def index_article(article):
+    index_articles(Article.objects.filter(pk=article.pk))
+
+
+def encode_cursor(score, pk):
+    return force_text(urlsafe_base64_encode(
+        force_bytes('%r|%d' % (score, pk))))
+
+
+def decode_cursor(token):
+    try:
+        score, pk = force_text(urlsafe_base64_decode(token)).split('|')
+        return float(score), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+
+
+def rank(terms, limit=None, after=None):
+    """Return ``[(score, article pk)]`` best match first, at most ``limit``
+    of them and only those ranked after the ``(score, pk)`` of ``after``.
+
+    The database sums, orders and limits the scores, so a page costs the
+    same whatever the number of matches. Scores are rounded so that the
+    order the postings are summed in can't move a result across a cursor.
+    """
+    stats = SearchDocument.objects.aggregate(count=Count('pk'),
+                                             avg_length=Avg('length'))
+    if not terms or not stats['count']:
+        return []
+    total, avg_length = stats['count'], stats['avg_length']
+
+    postings = SearchPosting.objects.filter(term__in=set(terms)).order_by()
+    idf = [When(term=term, then=Value(
+        math.log(1 + (total - df + 0.5) / (df + 0.5))))
+        for term, df in postings.values('term').annotate(
+            df=Count('pk')).values_list('term', 'df')]
+    if not idf:
+        return []
+    score = Case(*idf, output_field=FloatField()) * F('frequency') * (
+        K1 + 1) / (F('frequency') + Value(K1 * (1 - B)) +
+                   Value(K1 * B / avg_length) * F('length'))
+    ranked = postings.values('document_id').annotate(score=Func(
+        Sum(score, output_field=FloatField()), Value(SCORE_DIGITS),
+        function='ROUND', output_field=FloatField()))
+    if after is not None:
+        ranked = ranked.filter(Q(score__lt=after[0]) |
+                               Q(score=after[0], document_id__lt=after[1]))
+    ranked = ranked.order_by('-score', '-document_id').values_list(
+        'score', 'document_id')
+    return list(ranked[:limit] if limit else ranked)
+
+
+def highlight(text, pattern):
+    """Escape ``text`` and wrap the matches of ``pattern`` in <mark>."""
+    parts = []
+    last = 0
+    for match in pattern.finditer(text):
+        parts.append(escape(text[last:match.start()]))
+        parts.append('<mark>%s</mark>' % escape(match.group()))
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return ''.join(parts)
+
+
+def snippet(text, pattern):
+    text = ' '.join(text.split())
+    match = pattern.search(text)
+    start = max(0, match.start() - SNIPPET_LENGTH // 3) if match else 0
+    end = start + SNIPPET_LENGTH
+    result = highlight(text[start:end], pattern)
+    if start:
+        result = u'\u2026' + result
+    if end < len(text):
+        result += u'\u2026'
+    return result
+
+
+class SearchResult(object):
+    def __init__(self, article, score, title, snippet):
+        self.article = article
+        self.score = score
+        self.title = title
+        self.snippet = snippet
+
+
+def search(query, per_page, after=None):
+    """Return a page of results for ``query`` and the cursor of the next.
+
+    Raise ``InvalidCursor`` if ``after`` can not be decoded.
+    """
+    terms = tokenize(query)
+    ranked = rank(terms, per_page + 1,
+                  decode_cursor(after) if after else None)
+    page = ranked[:per_page]
+    next_cursor = encode_cursor(*page[-1]) if len(ranked) > per_page else None
+
+    articles = Article.published.select_related('category').only(
+        'title', 'slug', 'published_time', 'content_html',
+        'category__name', 'category__slug').in_bulk(
+            [pk for score, pk in page])
+    # The words as typed too, the terms lost their accents.
+    words = set(terms) | set(TOKEN_RE.findall(query.lower()))
+    pattern = re.compile('|'.join(
+        re.escape(word) for word in sorted(words, key=len, reverse=True)),
+        re.IGNORECASE | re.UNICODE)
+    results = []
+    for score, pk in page:
+        article = articles.get(pk)
+        if article is not None:
+            results.append(SearchResult(
+                article, score, highlight(article.title, pattern),
+                snippet(html_text(article.content_html), pattern)))
+    return results, next_cursor
@@ -0,0 +1,292 @@
+# coding: utf-8
+"""Keep the page cache, the article validators, the search index, the
+related articles, the published counts and the archives index in step with
+writes to the blog models."""
+from django.db.models.signals import (pre_save, post_save, pre_delete,
+                                      post_delete, m2m_changed)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, related, search, sitemaps
+from .models import (Category, Article, Page, Tag, RelatedArticle,
+                     ArchiveMonth)
+
+
+def article_scopes(article):
+    scopes = [cache.ARTICLES, cache.article_scope(article.slug),
+              cache.category_scope(article.category.slug)]
+    if article.pk:
+        scopes.extend(cache.tag_scope(slug)
+                      for slug in article.tags.values_list('slug', flat=True))
+    return scopes
+
+
+def category_scopes(category):
+    # Category names show up on every listing and article page.
+    tags = Tag.objects.filter(articles__category=category).values_list(
+        'slug', flat=True).distinct()
+    return [cache.ARTICLES, cache.category_scope(category.slug)] + [
+        cache.article_scope(slug) for slug in
+        category.article_set.values_list('slug', flat=True)] + [
+        cache.tag_scope(slug) for slug in tags]
+
+
+def tag_scopes(tag):
+    categories = Category.objects.filter(article__tags=tag).values_list(
+        'slug', flat=True).distinct()
+    return [cache.ARTICLES, cache.tag_scope(tag.slug)] + [
+        cache.article_scope(slug) for slug in
+        tag.articles.values_list('slug', flat=True)] + [
+        cache.category_scope(slug) for slug in categories]
+
+
+def page_scopes(page):
+    # Every page shows the navigation, which lists the published pages.
+    return [cache.page_scope(page.slug), cache.PAGES, cache.SITE]
+
+
+SCOPES = {
+    Article: article_scopes,
+    Category: category_scopes,
+    Tag: tag_scopes,
+    Page: page_scopes,
+}
+
+
+def remember_scopes(sender, instance, **kwargs):
+    """Store the scopes of the row as it is in the database.
+
+    A write may change a slug or move an article to another category, the
+    pages under the old values have to go as well.
+    """
+    old = None
+    if instance.pk:
+        old = sender._default_manager.filter(pk=instance.pk).first()
+    instance._cache_scopes = SCOPES[sender](old) if old is not None else []
+    instance._old_row = old
+
+
+def invalidate_saved(sender, instance, **kwargs):
+    cache.invalidate(*(instance._cache_scopes + SCOPES[sender](instance)))
+
+
+def invalidate_deleted(sender, instance, **kwargs):
+    cache.invalidate(*instance._cache_scopes)
+
+
+def invalidate_sitemap(sender, instance, **kwargs):
+    # Only the sitemap chunk holding the row.
+    cache.invalidate(sitemaps.chunk_scope(sender, instance.pk))
+
+
+for model in SCOPES:
+    pre_save.connect(remember_scopes, sender=model)
+    post_save.connect(invalidate_saved, sender=model)
+    pre_delete.connect(remember_scopes, sender=model)
+    post_delete.connect(invalidate_deleted, sender=model)
+    post_save.connect(invalidate_sitemap, sender=model)
+    post_delete.connect(invalidate_sitemap, sender=model)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def invalidate_tagged(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._cache_scopes = SCOPES[type(instance)](instance)
+        return
+    if action == 'post_clear':
+        cache.invalidate(*instance._cache_scopes)
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        # tag.articles.add(...)
+        articles = Article.objects.filter(pk__in=pk_set).values_list(
+            'slug', 'category__slug')
+        scopes = [cache.tag_scope(instance.slug)]
+        for slug, category_slug in articles:
+            scopes.append(cache.article_scope(slug))
+            scopes.append(cache.category_scope(category_slug))
+    else:
+        tags = Tag.objects.filter(pk__in=pk_set).values_list(
+            'slug', flat=True)
+        scopes = [cache.article_scope(instance.slug),
+                  cache.category_scope(instance.category.slug)] + [
+            cache.tag_scope(slug) for slug in tags]
+    cache.invalidate(cache.ARTICLES, *scopes)
+
+
+def touch_articles(queryset):
+    """Bump ``updated_time`` of articles whose rendered page changed without
+    the article row being saved, ETag, Last-Modified and the sitemap depend
+    on it."""
+    pks = list(queryset.values_list('pk', flat=True))
+    if pks:
+        Article.objects.filter(pk__in=pks).update(updated_time=timezone.now())
+        cache.invalidate(*sitemaps.chunk_scopes(Article, pks))
+
+
+@receiver(post_save, sender=Category)
+def touch_category_articles(sender, instance, created, **kwargs):
+    if not created:
+        touch_articles(Article.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_articles(sender, instance, created, **kwargs):
+    if not created:
+        touch_articles(Article.objects.filter(tags=instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_articles(sender, instance, **kwargs):
+    instance._article_ids = list(
+        instance.articles.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def touch_untagged_articles(sender, instance, **kwargs):
+    touch_articles(Article.objects.filter(pk__in=instance._article_ids))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def touch_retagged_articles(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._article_ids = list(
+            instance.articles.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            touch_articles(Article.objects.filter(pk=instance.pk))
+        elif action == 'post_clear':
+            touch_articles(
+                Article.objects.filter(pk__in=instance._article_ids))
+        else:
+            touch_articles(Article.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Article)
+def index_article(sender, instance, **kwargs):
+    # Drafts and hidden articles are dropped from the index.
+    search.index_article(instance)
+
+
+@receiver(post_save, sender=Article)
+def relate_article(sender, instance, raw, **kwargs):
+    old = instance._old_row
+    # Only the status and the category of the row itself count.
+    if raw:
+        return
+    if (old is None or old.status != instance.status or
+            old.category_id != instance.category_id):
+        related.refresh([instance.pk])
+    elif (old.title != instance.title or old.slug != instance.slug or
+          old.published_time != instance.published_time):
+        # The scores stay, but the lists holding the article show its
+        # title and link to it.
+        related.show_changes(RelatedArticle.objects.filter(
+            related=instance).values_list('article_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def relate_retagged_articles(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._related_ids = list(
+            instance.articles.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            related.refresh([instance.pk])
+        elif action == 'post_clear':
+            related.refresh(instance._related_ids)
+        else:
+            related.refresh(pk_set)
+
+
+@receiver(pre_delete, sender=Article)
+def remember_related_lists(sender, instance, **kwargs):
+    # The rows pointing at the article go with it.
+    instance._related_ids = list(RelatedArticle.objects.filter(
+        related=instance).values_list('article_id', flat=True))
+
+
+@receiver(post_delete, sender=Article)
+def relate_without_deleted(sender, instance, **kwargs):
+    related.refresh(instance._related_ids)
+
+
+@receiver(post_delete, sender=Tag)
+def relate_untagged_articles(sender, instance, **kwargs):
+    related.refresh(instance._article_ids)
+
+
+def recount(model, pks):
+    pks = list(pks)
+    model.objects.filter(pk__in=pks).recount()
+    # The sitemap only lists the rows with published articles.
+    cache.invalidate(*sitemaps.chunk_scopes(model, pks))
+
+
+def recount_tags(pks):
+    recount(Tag, pks)
+
+
+@receiver(post_save, sender=Article)
+def count_article(sender, instance, **kwargs):
+    old = instance._old_row
+    if (old is None or old.status != instance.status or
+            old.category_id != instance.category_id):
+        recount(Category, [instance.category_id] + (
+            [old.category_id] if old is not None else []))
+    if old is not None and old.status != instance.status:
+        recount_tags(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def count_retagged_articles(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._counted_tag_ids = list(
+            instance.tags.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            recount_tags([instance.pk])
+        elif action == 'post_clear':
+            recount_tags(instance._counted_tag_ids)
+        else:
+            recount_tags(pk_set)
+
+
+@receiver(pre_delete, sender=Article)
+def remember_counted_tags(sender, instance, **kwargs):
+    instance._counted_tag_ids = list(
+        instance.tags.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Article)
+def uncount_article(sender, instance, **kwargs):
+    recount(Category, [instance.category_id])
+    recount_tags(instance._counted_tag_ids)
+
+
+def archive_month(article):
+    published_time = article.published_time.astimezone(timezone.utc)
+    return published_time.year, published_time.month
+
+
+@receiver(post_save, sender=Article)
+def count_archive_months(sender, instance, **kwargs):
+    old = instance._old_row
+    if old is None:
+        if instance.status == 0:
+            ArchiveMonth.objects.recount([archive_month(instance)])
+    elif (old.status != instance.status or
+            old.published_time != instance.published_time):
+        ArchiveMonth.objects.recount([archive_month(old),
+                                      archive_month(instance)])
+
+
+@receiver(post_delete, sender=Article)
+def uncount_archive_month(sender, instance, **kwargs):
+    if instance._old_row is not None and instance._old_row.status == 0:
+        ArchiveMonth.objects.recount([archive_month(instance._old_row)])
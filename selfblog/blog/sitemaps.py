@@ -0,0 +1,143 @@
+# coding: utf-8
+"""sitemap.xml for crawlers, built for blogs with millions of URLs.
+
+``/sitemap.xml`` is an index of chunks, each covering ``SITEMAP_CHUNK``
+primary keys of articles, pages, categories or tags. A chunk is generated
+from a value query over its primary key range, without instantiating
+models, and cached until a row of its range is written (see
+``blog.signals``). Categories and tags without published articles are left
+out.
+"""
+import hashlib
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes, iri_to_uri
+
+from . import cache
+from .constants import SITEMAP_CHUNK
+from .models import Category, Article, Page, Tag
+
+
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def url_format(name, *kwargs):
+    """Reverse the URL ``name`` once into a format string with a field for
+    each keyword argument."""
+    values = dict((kwarg, str(10 ** 9 + i)) for i, kwarg in enumerate(kwargs))
+    url = reverse(name, kwargs=values)
+    for kwarg, value in values.items():
+        url = url.replace(value, '{%s}' % kwarg)
+    return url
+
+
+def article_urls(rows):
+    detail = url_format('blog:detail', 'year', 'month', 'slug')
+    for published_time, slug, updated_time in rows:
+        published_time = published_time.astimezone(timezone.utc)
+        yield detail.format(year=published_time.year,
+                            month=published_time.month,
+                            slug=slug), updated_time
+
+
+def slug_urls(name):
+    def urls(rows):
+        listing = url_format(name, 'slug')
+        for slug, updated_time in rows:
+            yield listing.format(slug=slug), updated_time
+    return urls
+
+
+# Section name: (published rows, fields, URLs of the rows)
+SECTIONS = OrderedDict([
+    ('articles', (Article.published, ['published_time', 'slug'],
+                  article_urls)),
+    ('pages', (Page.objects.filter(status=0), ['slug'],
+               slug_urls('blog:page'))),
+    ('categories', (Category.objects.filter(published_count__gt=0), ['slug'],
+                    slug_urls('blog:category'))),
+    ('tags', (Tag.objects.filter(published_count__gt=0), ['slug'],
+              slug_urls('blog:tag'))),
+])
+
+SECTION_NAMES = {
+    Article: 'articles',
+    Page: 'pages',
+    Category: 'categories',
+    Tag: 'tags',
+}
+
+
+def chunk_of(pk):
+    return (pk - 1) // SITEMAP_CHUNK
+
+
+def chunk_scope(model, pk):
+    """Cache scope of the chunk holding the row ``pk`` of ``model``."""
+    return 'sitemap:%s:%d' % (SECTION_NAMES[model], chunk_of(pk))
+
+
+def chunk_scopes(model, pks):
+    """Cache scopes of the chunks holding the rows ``pks`` of ``model``."""
+    return set(chunk_scope(model, pk) for pk in pks)
+
+
+def lastmod(updated_time):
+    return updated_time.astimezone(timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S+00:00')
+
+
+def render_chunk(base, name, chunk):
+    rows, fields, urls = SECTIONS[name]
+    start = chunk * SITEMAP_CHUNK + 1
+    rows = rows.filter(pk__gte=start, pk__lt=start + SITEMAP_CHUNK).order_by(
+        'pk').values_list(*(fields + ['updated_time']))
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<urlset xmlns="%s">\n' % XMLNS]
+    for url, updated_time in urls(rows.iterator()):
+        parts.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (
+            escape(iri_to_uri(base + url)), lastmod(updated_time)))
+    parts.append('</urlset>\n')
+    return ''.join(parts)
+
+
+def xml_response(content):
+    return HttpResponse(content, content_type='application/xml')
+
+
+def base_url(request):
+    return '%s://%s' % (request.scheme, request.get_host())
+
+
+def index(request):
+    """The sitemap index, listing every chunk up to the highest primary
+    key of each section."""
+    base = base_url(request)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<sitemapindex xmlns="%s">\n' % XMLNS]
+    for name, (rows, fields, urls) in SECTIONS.items():
+        last = rows.model.objects.aggregate(last=Max('pk'))['last']
+        if last is None:
+            continue
+        for chunk in range(chunk_of(last) + 1):
+            parts.append('<sitemap><loc>%s</loc></sitemap>\n' % escape(
+                base + reverse('blog:sitemap_section', args=[name, chunk])))
+    parts.append('</sitemapindex>\n')
+    return xml_response(''.join(parts))
+
+
+def section(request, name, chunk):
+    if name not in SECTIONS:
+        raise Http404
+    chunk = int(chunk)
+    base = base_url(request)
+    scope = 'sitemap:%s:%d' % (name, chunk)
+    key = 'blog:sitemap:%s' % hashlib.md5(force_bytes(
+        '%s|%s' % (base, scope))).hexdigest()
+    return xml_response(cache.cached(key, [cache.SITE, scope],
+                                     lambda: render_chunk(base, name, chunk)))
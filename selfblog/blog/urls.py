@@ -1,22 +1,77 @@
 from django.conf.urls import url
 
-from . import views
-from .feeds import BlogFeed
+from . import api, sitemaps, views
+from .cache import cache_public_page
+from .counters import count_views
+from .conditions import article_condition, page_condition, listing_condition
+from .feeds import BlogFeed, CategoryFeed, TagFeed
+
+
+def listing(view, scope='articles'):
+    return cache_public_page(scope)(listing_condition(view))
+
+
+def api_listing(view, scope='articles'):
+    return api.json_view(listing(view, scope))
+
 
 app_name = 'blog'
 urlpatterns = [
-    url(r'^$', views.IndexView.as_view(), name='index'),
+    url(r'^$', listing(views.IndexView.as_view()), name='index'),
     url(r'^post/(?P<year>\d+)/(?P<month>\d+)/(?P<slug>[\w|\-]+)$',
-        views.ArticleDetailView.as_view(),
+        count_views(cache_public_page('article:{slug}')(article_condition(
+            views.ArticleDetailView.as_view()))),
         name='detail'),
-    url(r'^archives/$', views.Archives.as_view(),
+    url(r'^page/(?P<slug>[\w|\-]+)/$',
+        cache_public_page('page:{slug}')(page_condition(
+            views.PageDetailView.as_view())),
+        name='page'),
+    # Not conditional, view counts change without touching the articles.
+    url(r'^popular/$',
+        cache_public_page('articles', 'popular')(views.PopularView.as_view()),
+        name='popular'),
+    url(r'^archives/$', listing(views.Archives.as_view()),
         name='archives'),
-    url(r'^categories/$', views.Categories.as_view(),
+    url(r'^archives/(?P<year>\d+)/$', listing(views.Archives.as_view()),
+        name='archive_year'),
+    url(r'^archives/(?P<year>\d+)/(?P<month>\d+)/$',
+        listing(views.ArchiveMonthView.as_view()), name='archive_month'),
+    url(r'^categories/$', listing(views.Categories.as_view()),
         name='categories'),
-    url(r'^category/(?P<slug>\w+)/$', views.CategoryListView.as_view(),
+    url(r'^category/(?P<slug>[\w|\-]+)/$',
+        listing(views.CategoryListView.as_view(), 'category:{slug}'),
         name='category'),
-    url(r'^tags/$', views.Tags.as_view(), name='tags'),
-    url(r'^tag/(?P<slug>[\w|\-]+)/$', views.TagsListView.as_view(),
+    url(r'^category/(?P<slug>[\w|\-]+)/feed/$',
+        listing(CategoryFeed(), 'category:{slug}'), name='category_feed'),
+    url(r'^tags/$', listing(views.Tags.as_view()), name='tags'),
+    url(r'^tag/(?P<slug>[\w|\-]+)/$',
+        listing(views.TagsListView.as_view(), 'tag:{slug}'),
         name='tag'),
-    url(r'^feeds/atom/$', BlogFeed()),
+    url(r'^tag/(?P<slug>[\w|\-]+)/feed/$',
+        listing(TagFeed(), 'tag:{slug}'), name='tag_feed'),
+    url(r'^search/$', listing(views.SearchView.as_view()), name='search'),
+    url(r'^feeds/atom/$', listing(BlogFeed()), name='feed'),
+    url(r'^api/articles/$', api_listing(api.articles), name='api_articles'),
+    url(r'^api/articles/(?P<year>\d+)/(?P<month>\d+)/(?P<slug>[\w|\-]+)/$',
+        api.json_view(cache_public_page('article:{slug}')(
+            article_condition(api.article))),
+        name='api_article'),
+    url(r'^api/categories/$', api_listing(api.categories),
+        name='api_categories'),
+    url(r'^api/categories/(?P<slug>[\w|\-]+)/$',
+        api_listing(api.category_articles, 'category:{slug}'),
+        name='api_category'),
+    url(r'^api/tags/$', api_listing(api.tags), name='api_tags'),
+    url(r'^api/tags/(?P<slug>[\w|\-]+)/$',
+        api_listing(api.tag_articles, 'tag:{slug}'), name='api_tag'),
+    url(r'^api/pages/$',
+        api.json_view(cache_public_page('pages')(api.pages)),
+        name='api_pages'),
+    url(r'^api/pages/(?P<slug>[\w|\-]+)/$',
+        api.json_view(cache_public_page('page:{slug}')(page_condition(
+            api.page))),
+        name='api_page'),
+    url(r'^sitemap\.xml$', sitemaps.index, name='sitemap'),
+    url(r'^sitemap-(?P<name>[a-z]+)-(?P<chunk>\d+)\.xml$',
+        sitemaps.section, name='sitemap_section'),
 ]
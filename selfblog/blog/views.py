@@ -1,13 +1,22 @@
 # coding: utf-8
 import logging
+from collections import OrderedDict
+from datetime import MAXYEAR, MINYEAR
 
+from django.conf import settings
+from django.core.cache import cache as default_cache
 from django.shortcuts import get_object_or_404
-from django.views.generic import ListView, DetailView
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+from django.views.generic import ListView, DetailView, TemplateView
 from django.core.paginator import Paginator, EmptyPage
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 
-from .models import Category, Article, Tag, Page
-from .constants import ITEMS_PER_PAGE
+from .models import Category, Article, Tag, Page, ArchiveMonth
+from .constants import (ITEMS_PER_PAGE, POPULAR_ARTICLES, ARCHIVE_CHUNK,
+                        FRAGMENT_CACHE_TIMEOUT)
+from .paginator import CursorPaginator, InvalidCursor, iterate_newest_first
+from . import cache, related, search
 
 
 logger = logging.getLogger(__name__)
@@ -30,17 +39,32 @@ class IndexView(ListView):
         return super(IndexView, self).get(request, *args, **kwargs)
 
     def get_queryset(self):
-        articles_list = Article.objects.filter(status=0)
+        articles_list = Article.published.for_listing()
         return articles_list
 
     def get_context_data(self, **kwargs):
+        kwargs[self.context_object_name] = self.paginate_articles()
+        return super(IndexView, self).get_context_data(**kwargs)
+
+    def paginate_articles(self):
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        # ?page=N keeps working as a fallback in cursor mode.
+        use_cursor = after or before or (
+            getattr(settings, 'BLOG_CURSOR_PAGINATION', False) and
+            'page' not in self.request.GET)
+        if use_cursor:
+            paginator = CursorPaginator(self.object_list, ITEMS_PER_PAGE)
+            try:
+                return paginator.page(after=after, before=before)
+            except InvalidCursor:
+                return paginator.page()
+
         paginator = Paginator(self.object_list, ITEMS_PER_PAGE)
         try:
-            items = paginator.page(self.current_page)
+            return paginator.page(self.current_page)
         except EmptyPage:
-            items = paginator.page(1)
-        kwargs[self.context_object_name] = items
-        return super(IndexView, self).get_context_data(**kwargs)
+            return paginator.page(1)
 
 
 class ArticleDetailView(DetailView):
@@ -49,11 +73,17 @@ class ArticleDetailView(DetailView):
     context_object_name = 'article'
 
     def get_object(self):
-        article = super(ArticleDetailView, self).get_object()
-        if article is not None and article.status != 0:
+        article = cache.published_article(int(self.kwargs['year']),
+                                          int(self.kwargs['month']),
+                                          self.kwargs['slug'])
+        if article is None:
             raise Http404
         return article
 
+    def get_context_data(self, **kwargs):
+        kwargs['related_articles'] = related.related_articles(self.object)
+        return super(ArticleDetailView, self).get_context_data(**kwargs)
+
 
 class PageDetailView(DetailView):
     model = Page
@@ -67,14 +97,81 @@ class PageDetailView(DetailView):
         return page
 
 
-class Archives(ListView):
-    template_name = 'blog/archives.html'
+class PopularView(ListView):
+    template_name = 'blog/index.html'
     context_object_name = 'articles_list'
 
     def get_queryset(self):
-        articles_list = Article.objects.filter(status=0).only(
-            'id', 'title', 'published_time').order_by('-published_time')
-        return articles_list
+        return Article.published.for_listing().filter(
+            view_count__views__gt=0).order_by(
+                '-view_count__views', '-published_time')[:POPULAR_ARTICLES]
+
+
+class Archives(TemplateView):
+    """The titles of all published articles, or those of one year, grouped
+    by month.
+
+    The response is streamed: the layout is rendered around a marker and
+    the months of the archives index follow one after the other. Each month
+    is read in ``ARCHIVE_CHUNK`` rows per query, rendered and cached as a
+    fragment until an article is written. Memory use grows with the largest
+    month, not the blog.
+    """
+    template_name = 'blog/archives.html'
+    month_template_name = 'blog/archive_month.html'
+    marker = '<!-- archive months -->'
+
+    def get(self, request, year=None, **kwargs):
+        # A dozen rows per year, the index is small.
+        counts = OrderedDict(((m.year, m.month), m.count)
+                             for m in ArchiveMonth.objects.all())
+        years = OrderedDict()
+        for (month_year, month), count in counts.items():
+            years[month_year] = years.get(month_year, 0) + count
+
+        if year is not None:
+            year = int(year)
+            if year not in years:
+                raise Http404
+            counts = OrderedDict((month, count)
+                                 for month, count in counts.items()
+                                 if month[0] == year)
+        context = self.get_context_data(year=year, years=years.items(),
+                                        months=mark_safe(self.marker))
+        head, tail = render_to_string(self.template_name, context,
+                                      request).split(self.marker)
+        return StreamingHttpResponse(self.stream(head, tail, counts))
+
+    def stream(self, head, tail, counts):
+        yield head
+        template = get_template(self.month_template_name)
+        versions = cache.get_versions([cache.SITE, cache.ARTICLES])
+        for (year, month), count in counts.items():
+            key = 'blog:archive:%s:%d:%d' % ('|'.join(versions), year, month)
+            fragment = default_cache.get(key)
+            if fragment is None:
+                articles = [
+                    {'title': title, 'slug': slug,
+                     'published_time': published_time}
+                    for published_time, pk, title, slug in
+                    iterate_newest_first(
+                        Article.published.in_month(year, month),
+                        ['title', 'slug'], ARCHIVE_CHUNK)]
+                fragment = template.render({
+                    'year': year, 'month': month, 'count': count,
+                    'articles': articles})
+                default_cache.set(key, fragment, FRAGMENT_CACHE_TIMEOUT)
+            yield fragment
+        yield tail
+
+
+class ArchiveMonthView(IndexView):
+    def get_queryset(self):
+        year, month = int(self.kwargs['year']), int(self.kwargs['month'])
+        # The archives of MAXYEAR would end in a year datetime can't hold.
+        if not (MINYEAR <= year < MAXYEAR and 1 <= month <= 12):
+            raise Http404
+        return Article.published.for_listing().in_month(year, month)
 
 
 class Categories(ListView):
@@ -82,12 +179,10 @@ class Categories(ListView):
     context_object_name = 'categories'
 
     def get_queryset(self):
-        categories = Category.objects.filter(article__status=0)
-        category_article_count = {}
-        for category in categories:
-            category_article_count[category] = \
-                category_article_count.get(category, 0) + 1
-        return sorted(category_article_count.items(), key=lambda k: k[0].name)
+        categories = Category.objects.filter(
+            published_count__gt=0).order_by('name')
+        return [(category, category.published_count)
+                for category in categories]
 
 
 class CategoryListView(IndexView):
@@ -95,9 +190,8 @@ class CategoryListView(IndexView):
     context_object_name = 'articles_list'
 
     def get_queryset(self):
-        articles_list = Article.objects.filter(
-            category__slug=self.kwargs['slug'],
-            status=0)
+        articles_list = Article.published.for_listing().filter(
+            category__slug=self.kwargs['slug'])
         return articles_list
 
 
@@ -106,12 +200,8 @@ class Tags(ListView):
     context_object_name = 'tags'
 
     def get_queryset(self):
-        tags = Tag.objects.filter(articles__status=0)
-        tag_article_count = {}
-        for tag in tags:
-            tag_article_count[tag] = \
-                tag_article_count.get(tag, 0) + 1
-        return sorted(tag_article_count.items(), key=lambda k: k[0].name)
+        tags = Tag.objects.filter(published_count__gt=0).order_by('name')
+        return [(tag, tag.published_count) for tag in tags]
 
 
 class TagsListView(IndexView):
@@ -119,7 +209,20 @@ class TagsListView(IndexView):
 
     def get_queryset(self):
         tag = get_object_or_404(Tag, slug=self.kwargs['slug'])
-        articles_list = Article.objects.filter(
-            status=0,
+        articles_list = Article.published.for_listing().filter(
             tags__in=[tag])
         return articles_list
+
+
+class SearchView(TemplateView):
+    template_name = 'blog/search.html'
+
+    def get_context_data(self, **kwargs):
+        query = self.request.GET.get('q', '').strip()
+        try:
+            results, next_cursor = search.search(
+                query, ITEMS_PER_PAGE, self.request.GET.get('after'))
+        except search.InvalidCursor:
+            results, next_cursor = search.search(query, ITEMS_PER_PAGE)
+        kwargs.update(query=query, results=results, next_cursor=next_cursor)
+        return super(SearchView, self).get_context_data(**kwargs)
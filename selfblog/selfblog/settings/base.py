@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'blog.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'selfblog.urls'
@@ -78,6 +80,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'blog.context_processors.blog',
             ],
         },
     },
@@ -96,6 +99,8 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -134,3 +139,39 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Blog
+
+# Paginate article listings with ?after=/?before= tokens instead of
+# ?page=N, which avoids the COUNT(*) and OFFSET scans on deep pages.
+BLOG_CURSOR_PAGINATION = False
+
+# Cache the rendered public pages, see blog/cache.py.
+BLOG_PAGE_CACHE = False
+
+# Also keep highlighted code blocks in the default cache, so they survive
+# restarts. Only useful with a shared backend such as memcached.
+BLOG_PERSISTENT_HIGHLIGHT_CACHE = False
+
+# Database aliases the public views read from, see blog/routers.py.
+BLOG_READ_REPLICAS = []
+
+# How long a client keeps reading from the primary after a write, and every
+# client after a write invalidated cached pages. Should be longer than the
+# replication lag.
+BLOG_REPLICA_STICKY_SECONDS = 10
+
+# Share of the requests timed by blog.profiling.ProfilingMiddleware, off
+# unless a settings module turns it on.
+BLOG_PROFILING_SAMPLE_RATE = 0
+
+# Count the views of articles for the popular posts page.
+BLOG_COUNT_VIEWS = False
+
+# Seconds between writes of the buffered article view counts, 0 writes
+# them on every view. See blog/counters.py.
+BLOG_VIEW_FLUSH_SECONDS = 0
+
+# Entries of the Atom feeds.
+BLOG_FEED_ITEMS = 20
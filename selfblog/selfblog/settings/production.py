@@ -10,6 +10,39 @@ DATABASES = {
         'NAME': get_env_variable('BLOG_DB_NAME'),
         'USER': get_env_variable('BLOG_DB_USER'),
         'PASSWORD': get_env_variable('BLOG_DB_PASSWORD'),
-        'HOST': get_env_variable('BLOG_DB_HOST')
+        'HOST': get_env_variable('BLOG_DB_HOST'),
+        # Keep connections open between requests, 0 closes them.
+        'CONN_MAX_AGE': int(os.environ.get('BLOG_DB_CONN_MAX_AGE', 60)),
     }
 }
+
+# Comma separated hosts of read replicas of the default database.
+BLOG_READ_REPLICAS = []
+for i, host in enumerate(
+        filter(None, os.environ.get('BLOG_DB_REPLICA_HOSTS', '').split(','))):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip())
+    BLOG_READ_REPLICAS.append(alias)
+
+
+# The page cache, its scope versions, which are also part of the ETags, and
+# the hot articles must be shared by every worker, or a write would only
+# reach the worker which handled it. Memcached evicts the least recently
+# used keys when full. The file based cache would cull keys at random past
+# its MAX_ENTRIES, scope versions included, list every file on each write
+# to count them, and its add(), which locks pages being rendered again, is
+# not atomic. BLOG_MEMCACHED takes comma separated servers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': get_env_variable('BLOG_MEMCACHED').split(','),
+    }
+}
+
+BLOG_PAGE_CACHE = True
+
+BLOG_PROFILING_SAMPLE_RATE = 0.05
+
+BLOG_COUNT_VIEWS = True
+
+BLOG_VIEW_FLUSH_SECONDS = 10
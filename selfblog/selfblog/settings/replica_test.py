@@ -0,0 +1,18 @@
+from .base import *
+
+
+# Two SQLite databases standing in for a primary and its read replica, for
+#   ./manage.py test blog.tests.ReplicaRoutingTest \
+#       --settings=selfblog.settings.replica_test
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    },
+}
+
+BLOG_READ_REPLICAS = ['replica']
@@ -13,4 +13,3 @@ DATABASES = {
         'HOST': '127.0.0.1'
     }
 }
-
@@ -16,7 +16,11 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 
+from blog.admin import profiling_view
+
 urlpatterns = [
     url(r'^', include('blog.urls')),
+    url(r'^admin/profiling/$', admin.site.admin_view(profiling_view),
+        name='profiling'),
     url(r'^admin/', admin.site.urls),
 ]